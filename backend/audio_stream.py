@@ -0,0 +1,101 @@
+"""Fan-out of device audio frames to WebSocket viewers, decimated per requested resolution."""
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+
+_MAX_PENDING_DEVICES = 256  # Device ids are client supplied - keep the carry-over of the most recent ones
+
+
+class _Resolution:
+    """
+    Subscribers sharing one points-per-second setting. Each frame is reduced to a
+    min/max envelope (one pair per bucket, so two points per bucket) and serialized
+    once for all of them. Samples that don't fill a bucket carry over to the device's
+    next frame - kept per device, so concurrent streams never share a bucket.
+    """
+
+    def __init__(self, points_per_second: Optional[int]):
+        self.points_per_second = points_per_second
+        self.subscribers: List[WebSocket] = []
+        self.pending: Dict[str, Tuple[int, np.ndarray]] = {}  # device -> (samples per bucket, leftover)
+
+    def payload(self, frame: Dict, samples: np.ndarray) -> str:
+        if self.points_per_second is None:
+            return json.dumps(frame)
+
+        sample_rate = frame.get("sample_rate") or 16000
+        samples_per_bucket = max(1, round(2 * sample_rate / self.points_per_second))
+        device = frame.get("device_id", "")
+        pending_samples_per_bucket, pending = self.pending.get(device, (samples_per_bucket, None))
+        if pending is None or pending_samples_per_bucket != samples_per_bucket:
+            pending = np.empty(0, dtype=np.int64)
+
+        data = np.concatenate([pending, samples]) if pending.size else samples
+        n_full = len(data) - len(data) % samples_per_bucket
+        self.pending.pop(device, None)  # Re-inserted last: the dict stays in least recently seen order
+        self.pending[device] = (samples_per_bucket, data[n_full:])
+        if len(self.pending) > _MAX_PENDING_DEVICES:
+            del self.pending[next(iter(self.pending))]
+        buckets = data[:n_full].reshape(-1, samples_per_bucket)
+
+        return json.dumps({
+            "type": "debug-samples-envelope",
+            "mins": buckets.min(axis=1).tolist(),
+            "maxs": buckets.max(axis=1).tolist(),
+            "samples_per_point": samples_per_bucket,
+            "n_samples": int(samples.size),
+            "frame_min": int(samples.min()) if samples.size else None,
+            "frame_max": int(samples.max()) if samples.size else None,
+            "is_bounce": frame.get("is_bounce", False),
+            "bounce_ctr": frame.get("bounce_ctr"),
+            "sample_rate": sample_rate,
+            "device_id": frame.get("device_id"),
+        })
+
+
+class AudioStreamHub:
+    """Audio viewers grouped by resolution; `None` means raw frames, as sent by the device."""
+
+    def __init__(self):
+        self.resolutions: Dict[Optional[int], _Resolution] = {}
+
+    @property
+    def num_clients(self) -> int:
+        return sum(len(res.subscribers) for res in self.resolutions.values())
+
+    def subscribe(self, websocket: WebSocket, points_per_second: Optional[int] = None):
+        if points_per_second not in self.resolutions:
+            self.resolutions[points_per_second] = _Resolution(points_per_second)
+        self.resolutions[points_per_second].subscribers.append(websocket)
+
+    def unsubscribe(self, websocket: WebSocket):
+        for key, res in list(self.resolutions.items()):
+            if websocket in res.subscribers:
+                res.subscribers.remove(websocket)
+            if not res.subscribers:
+                del self.resolutions[key]
+
+    async def broadcast(self, frame: Dict):
+        if not self.resolutions:
+            return
+
+        samples = np.asarray(frame["samples"], dtype=np.int64)
+        disconnected = []
+        for res in list(self.resolutions.values()):
+            payload = res.payload(frame, samples)
+            for connection in res.subscribers:
+                try:
+                    await connection.send_text(payload)
+                except Exception as e:
+                    logger.warning(f"Failed to send to WebSocket client: {e}")
+                    disconnected.append(connection)
+
+        # Remove disconnected clients
+        for conn in disconnected:
+            self.unsubscribe(conn)
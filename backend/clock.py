@@ -0,0 +1,68 @@
+"""Time sources of the controller: the wall clock, or a virtual clock for replays and tests."""
+import asyncio
+import heapq
+import itertools
+import time
+
+from metrics import now_ms
+
+
+# Event loop turns given to pending tasks before the virtual clock moves on, e.g. for a woken
+# countdown to free its room and notify. The controller's tasks only await in-memory stores.
+_SETTLE_YIELDS = 10
+
+
+class SystemClock:
+    def time(self) -> float:
+        return time.time()
+
+    def now_ms(self) -> int:
+        return now_ms()
+
+    async def sleep(self, secs: float):
+        await asyncio.sleep(secs)
+
+
+class VirtualClock:
+    """
+    A clock that only moves when advanced, e.g. by a replay feeding recorded events.
+
+    `sleep()` parks the caller until the clock is advanced past its deadline, so a 10 minute
+    countdown completes as soon as the replay's next event lies beyond it - no real waiting.
+    Sleepers are woken in deadline order, each seeing the clock at its own deadline.
+    """
+
+    def __init__(self, start: float = 0.0):
+        self._now = start
+        self._sleepers = []  # Heap of (deadline, seq, future)
+        self._seq = itertools.count()
+
+    def time(self) -> float:
+        return self._now
+
+    def now_ms(self) -> int:
+        return int(self._now * 1000)
+
+    async def sleep(self, secs: float):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self._now + max(0.0, secs), next(self._seq), future))
+        await future
+
+    async def advance_to(self, t: float):
+        """Move the clock to `t` (never backwards), waking every sleeper due by then."""
+        await self._settle()  # Tasks created since the last advance may be about to sleep
+        while self._sleepers and self._sleepers[0][0] <= t:
+            deadline, _, future = heapq.heappop(self._sleepers)
+            if future.done():
+                continue  # Cancelled sleep, e.g. a countdown restarted by a bounce
+            self._now = max(self._now, deadline)
+            future.set_result(None)
+            await self._settle()
+        self._now = max(self._now, t)
+
+    async def _settle(self):
+        for _ in range(_SETTLE_YIELDS):
+            await asyncio.sleep(0)
+
+    async def advance(self, secs: float):
+        await self.advance_to(self._now + secs)
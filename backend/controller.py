@@ -1,75 +1,304 @@
 import asyncio
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 import enum
 import logging 
 import time
 
+from clock import SystemClock
+from fusion import EventFusion
+from metrics import LatencyStats
+from sessions import RoomSession
+from shared_state import (
+    DEFAULT_ROOM, ROOM_EVENTS_CHANNEL, ROOM_SESSION_CHANNEL, ROOM_STATE_CHANNEL, LocalPubSub, LocalRoomStore,
+)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+_DEFAULT_ROOM_LEASE_SECS = 10
+_DEFAULT_SEEN_EVENT_IDS = 4096  # Per room - covers a device's whole offline queue being resent
+
+
 class RoomState:
-    def __init__(self, notifier=None):
-        self.is_free = True
-        self.last_state_change_time = time.time()
+    def __init__(self, notifier=None, room=DEFAULT_ROOM, is_free=True, last_state_change_time=None, clock=None):
+        self.clock = clock if clock is not None else SystemClock()
+        self.room = room
+        self.is_free = is_free
+        self.last_state_change_time = self.clock.time() if last_state_change_time is None else last_state_change_time
         self.notifier = notifier
 
     def __str__(self):
-        return f"[{self.state} at {self.last_state_change_time:.3f}  (time now - {time.time():.3f}, diff - {time.time() - self.last_state_change_time:.3f}s)]"
+        now = self.clock.time()
+        return f"[{self.room}: {self.state} at {self.last_state_change_time:.3f}  (time now - {now:.3f}, diff - {now - self.last_state_change_time:.3f}s)]"
 
     def asdict(self):
-        return {"state": self.state, "last_state_change_time": self.last_state_change_time}
+        return {"room": self.room, "state": self.state, "last_state_change_time": self.last_state_change_time}
+
+    @classmethod
+    def fromdict(cls, data, notifier=None, clock=None):
+        return cls(notifier=notifier, room=data["room"], is_free=data["state"] == "free",
+                   last_state_change_time=data["last_state_change_time"], clock=clock)
 
     @property
     def state(self):
         return "free" if self.is_free else "taken"
 
     async def take(self):
+        """Returns whether the state changed. Re-taking a taken room doesn't notify again."""
+        if not self.is_free:
+            return False
         self.is_free = False
-        self.last_state_change_time = time.time()
+        self.last_state_change_time = self.clock.time()
         await self.notifier.notify(self)
+        return True
 
     async def free(self):
         self.is_free = True
-        self.last_state_change_time = time.time()
+        self.last_state_change_time = self.clock.time()
         await self.notifier.notify(self)
+        return True
 
 
 
 class Controller:
+    """
+    Tracks the state of every room. With several backend workers, each room is owned by one
+    of them (a lease in the shared store): only the owner runs the room's countdown and
+    notifies, other workers forward the room's events to it.
+
+    The owner also tracks each room's rallies and games (`RoomSession`). Their stats are kept
+    up to date in memory and saved to the store on every rally boundary, for other workers.
+
+    In rooms with several microphones, the owner first fuses the devices' detections
+    (`EventFusion`) - it sees all of a room's events - and only acts on confirmed bounces.
+
+    Room state times and countdowns follow `clock` - a `VirtualClock` lets replays and tests
+    run the idle countdown without waiting for it. Leases stay on the wall clock.
+    """
 
-    def __init__(self, cfg, notifier):
+    def __init__(self, cfg, notifier, store=None, pubsub=None, worker_id="local", clock=None):
         self.cfg = cfg
         self.time_without_event_to_declare_idle_secs = cfg["time_without_event_to_declare_idle_secs"]
+        self.room_lease_secs = cfg.get("room_lease_secs", _DEFAULT_ROOM_LEASE_SECS)
+        self.seen_event_ids_max = cfg.get("seen_event_ids", _DEFAULT_SEEN_EVENT_IDS)
+        self.sessions_cfg = cfg.get("sessions", {})
+        self.fusion = EventFusion(cfg.get("fusion", {}))
         self.notifier = notifier
-        self.room_state = RoomState(notifier=self.notifier)
-        self.free_room_task = None
-        print(self.room_state)
+        self.store = store if store is not None else LocalRoomStore()
+        self.pubsub = pubsub if pubsub is not None else LocalPubSub(worker_id)
+        self.worker_id = worker_id
+        self.clock = clock if clock is not None else SystemClock()
 
-    async def handle_event(self, event):
+        # Rooms this worker owns: their states, sessions, lease expiry and countdowns
+        self.room_states = {}
+        self.sessions = {}
+        self.seen_event_ids = {}
+        self.lease_expires_at = {}
+        self.free_room_tasks = {}
+        self.lease_task = None
+
+        self.latency_stats = LatencyStats()
+        self.pubsub.subscribe(ROOM_EVENTS_CHANNEL, self._on_forwarded_event)
+
+    def start(self):
+        self.lease_task = asyncio.create_task(self._maintain_leases())
+
+    async def close(self):
+        if self.lease_task is not None:
+            self.lease_task.cancel()
+        for task in self.free_room_tasks.values():
+            task.cancel()
+        for room in list(self.room_states):
+            await self.store.release(room, self.worker_id)
+
+    @staticmethod
+    def validate_event(event):
+        if not isinstance(event, dict):
+            raise ValueError("Illegal event. Not an object")
         event_type = event.get("type")
         if event_type is None:
             raise ValueError("Illegal event. No `type`")
-
-        if event_type == "bounce-detected":
-            await self.handle_room_taken_indication(event)
-        else: 
+        if event_type != "bounce-detected":
             raise ValueError(f"Unknown event type: {event_type}")
 
-    def start_countdown_to_free_room(self):
-        if self.free_room_task is not None:
-            self.free_room_task.cancel()
-        self.free_room_task = asyncio.create_task(self._countdown_to_free_room())
+    async def handle_event(self, event, received_at_ms=None):
+        if received_at_ms is None:
+            received_at_ms = self.clock.now_ms()
+
+        self.validate_event(event)
+        room = event.get("room", DEFAULT_ROOM)
+        if await self._own(room):
+            await self._handle_owned_event(event, received_at_ms)
+        else:
+            await self.pubsub.publish(ROOM_EVENTS_CHANNEL, {"event": event, "received_at_ms": received_at_ms})
+
+    async def _on_forwarded_event(self, message):
+        # Every worker sees forwarded events; the one holding (or taking over) the lease handles it
+        event = message["event"]
+        if await self._own(event.get("room", DEFAULT_ROOM)):
+            await self._handle_owned_event(event, message["received_at_ms"])
+
+    async def _handle_owned_event(self, event, received_at_ms):
+        room = event.get("room", DEFAULT_ROOM)
+        if self._is_duplicate(room, event):
+            logger.info(f"Ignoring already handled event {event['event_id']}")
+            return
 
-    async def _countdown_to_free_room(self):
-        await asyncio.sleep(self.time_without_event_to_declare_idle_secs)
-        logger.info(f"Countdown to free room completed. Freeing room.")
-        await self.room_state.free()
+        event = self.fusion.add(room, event, event.get("captured_at_ms"))
+        if event is None:
+            return  # Not confirmed (yet) by enough devices
+
+        notified = await self.handle_room_taken_indication(event)
+        self._record_latencies(event, received_at_ms, notified_at_ms=self.clock.now_ms() if notified else None)
+        await self._publish_session_events(room, self.sessions[room].on_bounce(event.get("captured_at_ms") or received_at_ms))
+
+    def _is_duplicate(self, room, event):
+        """Devices resend a whole batch when they didn't get its ack; `event_id` makes that harmless."""
+        event_id = event.get("event_id")
+        if event_id is None:
+            return False
+        seen = self.seen_event_ids.setdefault(room, OrderedDict())
+        if event_id in seen:
+            seen.move_to_end(event_id)
+            return True
+        seen[event_id] = None
+        if len(seen) > self.seen_event_ids_max:
+            seen.popitem(last=False)
+        return False
+
+    async def _publish_session_events(self, room, session_events):
+        if not session_events:
+            return
+        for session_event in session_events:
+            logger.info(f"Session event: {session_event}")
+            await self.pubsub.publish(ROOM_SESSION_CHANNEL, session_event)
+        await self.store.save_session_stats(room, self.sessions[room].asdict())
+
+    async def _own(self, room):
+        """Whether this worker owns the room, acquiring its lease if it's unowned."""
+        # Owned rooms are renewed in the background; only go to the store when the lease runs low
+        if self.lease_expires_at.get(room, 0) - time.time() > self.room_lease_secs / 2:
+            return True
+        if not await self.store.acquire(room, self.worker_id, self.room_lease_secs):
+            self._drop_room(room)
+            return False
+
+        lease_expires_at = time.time() + self.room_lease_secs
+        if room not in self.room_states:
+            await self._adopt_room(room)
+        # Only after adopting, so concurrent events don't take the fast path to a missing room state
+        self.lease_expires_at[room] = lease_expires_at
+        return True
+
+    async def _adopt_room(self, room):
+        """Pick up a room's state, resuming the previous owner's countdown if it was taken."""
+        saved = await self.store.load(room)
+        saved_session = await self.store.load_session_stats(room)
+        if room in self.room_states:
+            return  # Adopted by a concurrent event meanwhile
+        self.sessions[room] = RoomSession(room, self.sessions_cfg, snapshot=saved_session)
+        if saved is None:
+            self.room_states[room] = RoomState(notifier=self.notifier, room=room, clock=self.clock)
+            return
+
+        room_state = RoomState.fromdict(saved, notifier=self.notifier, clock=self.clock)
+        self.room_states[room] = room_state
+        logger.info(f"Worker {self.worker_id} took ownership of room {room}: {room_state}")
+        if not room_state.is_free:
+            elapsed = self.clock.time() - room_state.last_state_change_time
+            self.start_countdown_to_free_room(room, max(0.0, self.time_without_event_to_declare_idle_secs - elapsed))
+
+    def _drop_room(self, room):
+        self.lease_expires_at.pop(room, None)
+        self.room_states.pop(room, None)
+        self.sessions.pop(room, None)
+        self.seen_event_ids.pop(room, None)
+        self.fusion.forget(room)
+        task = self.free_room_tasks.pop(room, None)
+        if task is not None:
+            task.cancel()
+
+    async def _maintain_leases(self):
+        """Renew the leases of owned rooms, adopt rooms whose owner went away and end stale rallies."""
+        while True:
+            await asyncio.sleep(self.room_lease_secs / 3)
+            try:
+                for room, session in list(self.sessions.items()):
+                    await self._publish_session_events(room, session.expire(self.clock.now_ms()))
+                for room in list(self.room_states) + await self.store.orphaned_rooms():
+                    if room in self.room_states:
+                        self.lease_expires_at.pop(room, None)  # Force a renewal
+                    await self._own(room)
+            except Exception as e:
+                logger.error(f"Error maintaining room leases: {e}", exc_info=True)
+
+    async def _publish_room_state(self, room_state):
+        state = room_state.asdict()
+        await self.store.save(room_state.room, state)
+        await self.pubsub.publish(ROOM_STATE_CHANNEL, state)
+
+    def _record_latencies(self, event, received_at_ms, notified_at_ms=None):
+        # `captured_at_ms` and `sent_at_ms` are already in backend time - the device
+        # converts its ticks using the offset estimated through /clock-sync.
+        # `notified_at_ms` is None when the bounce didn't change the room's state (no notification).
+        captured_at_ms = event.get("captured_at_ms")
+        sent_at_ms = event.get("sent_at_ms")
+        if captured_at_ms is not None:
+            self.latency_stats.record("capture_to_receipt", received_at_ms - captured_at_ms)
+            if notified_at_ms is not None:
+                self.latency_stats.record("capture_to_notification", notified_at_ms - captured_at_ms)
+            if sent_at_ms is not None:
+                self.latency_stats.record("capture_to_send", sent_at_ms - captured_at_ms)
+        if sent_at_ms is not None:
+            self.latency_stats.record("send_to_receipt", received_at_ms - sent_at_ms)
+        if notified_at_ms is not None:
+            self.latency_stats.record("receipt_to_notification", notified_at_ms - received_at_ms)
+
+    def start_countdown_to_free_room(self, room, delay_secs=None):
+        if delay_secs is None:
+            delay_secs = self.time_without_event_to_declare_idle_secs
+        if room in self.free_room_tasks:
+            self.free_room_tasks[room].cancel()
+        self.free_room_tasks[room] = asyncio.create_task(self._countdown_to_free_room(room, delay_secs))
+
+    async def _countdown_to_free_room(self, room, delay_secs):
+        await self.clock.sleep(delay_secs)
+        logger.info(f"Countdown to free room {room} completed. Freeing room.")
+        self.free_room_tasks.pop(room, None)
+        room_state = self.room_states[room]
+        await room_state.free()
+        await self._publish_room_state(room_state)
+        await self._publish_session_events(room, self.sessions[room].end_session())
 
     async def handle_room_taken_indication(self, event):
+        """Returns whether the room turned taken (and was notified)."""
         logger.info(f"Room taken indication received: {event}")
-        await self.room_state.take()
-        self.start_countdown_to_free_room()
+        room_state = self.room_states[event.get("room", DEFAULT_ROOM)]
+        notified = await room_state.take()
+        if notified:
+            await self._publish_room_state(room_state)
+        self.start_countdown_to_free_room(room_state.room)
+        return notified
+
+    async def get_room_state(self, room=DEFAULT_ROOM):
+        """Any worker can answer: owned rooms from memory, the rest from the shared store."""
+        if room in self.room_states:
+            return self.room_states[room].asdict()
+        saved = await self.store.load(room)
+        return saved if saved is not None else RoomState(room=room, clock=self.clock).asdict()
+
+    async def get_session_stats(self, room=DEFAULT_ROOM):
+        """Owned rooms are live; others as of their last rally boundary."""
+        if room in self.sessions:
+            return self.sessions[room].asdict()
+        saved = await self.store.load_session_stats(room)
+        return saved if saved is not None else RoomSession(room, self.sessions_cfg).asdict()
+
+    def get_latency_stats(self):
+        return self.latency_stats.asdict()
 
-    def get_room_state(self):
-        return self.room_state.asdict() 
\ No newline at end of file
+    def get_fusion_stats(self):
+        """Detections per room on this worker, and how many confirmed, were absorbed into or missed a bounce."""
+        return self.fusion.asdict()
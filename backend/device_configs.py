@@ -0,0 +1,49 @@
+"""Validation of the per-device detector config overrides devices poll for (stored in shared_state)."""
+from typing import Any, Dict
+
+
+# Detector settings a device applies live, between two windows, and their types.
+# Anything else (sample rate, window size, threading...) needs a config.json change and a reset.
+TUNABLE_KEYS = {
+    "bounce_threshold": (int, float),
+    "rolling_max_short_decay_factor": (int, float),
+    "rolling_max_long_decay_factor": (int, float),
+    "highpass_filter_cutoff_freq": (int, float),
+    "engine": (str,),
+    "band_low_freq": (int, float),
+    "band_high_freq": (int, float),
+    "band_min_ratio": (int, float),
+    "debug": (bool,),
+}
+
+ENGINES = {"iir", "iir_fused", "band"}  # As in device/modules/detector.py
+
+# Not tunable live, so the same on every device unless its config.json says otherwise -
+# the device checks again against its own rate
+DEVICE_SAMPLE_RATE = 16000
+
+
+def validate(config: Any) -> Dict[str, Any]:
+    """Raises ValueError on anything a device couldn't apply live."""
+    if not isinstance(config, dict):
+        raise ValueError("Config must be an object")
+    for key, value in config.items():
+        if key not in TUNABLE_KEYS:
+            raise ValueError(f"'{key}' can't be changed live (tunable: {sorted(TUNABLE_KEYS)})")
+        # bool is an int subclass - don't let `true` through as a threshold
+        if not isinstance(value, TUNABLE_KEYS[key]) or (isinstance(value, bool) and bool not in TUNABLE_KEYS[key]):
+            raise ValueError(f"Invalid type for '{key}': {type(value).__name__}")
+    for key in ("rolling_max_short_decay_factor", "rolling_max_long_decay_factor"):
+        if key in config and not 0 <= config[key] < 1:
+            raise ValueError(f"'{key}' must be in [0, 1)")
+    if "engine" in config and config["engine"] not in ENGINES:
+        raise ValueError(f"Unknown detector engine: {config['engine']} (one of {sorted(ENGINES)})")
+    nyquist = DEVICE_SAMPLE_RATE / 2
+    if "highpass_filter_cutoff_freq" in config and not 0 < config["highpass_filter_cutoff_freq"] < nyquist:
+        raise ValueError(f"'highpass_filter_cutoff_freq' must be above 0 and below Nyquist ({nyquist:.0f}Hz)")
+    for key in ("band_low_freq", "band_high_freq"):
+        if key in config and not 0 <= config[key] <= nyquist:
+            raise ValueError(f"'{key}' must be between 0 and Nyquist ({nyquist:.0f}Hz)")
+    if config.get("band_low_freq", 0) >= config.get("band_high_freq", nyquist):
+        raise ValueError("'band_low_freq' must be below 'band_high_freq'")
+    return config
@@ -0,0 +1,121 @@
+"""Cross-device confirmation of bounces, for rooms with more than one microphone."""
+from bisect import bisect_left, bisect_right, insort
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+_DEFAULT_MIN_DEVICES = 1        # One device is enough - fusion is a pass-through
+_DEFAULT_TOLERANCE_MS = 100     # Two devices hear the same bounce within this much of each other
+_DEFAULT_WINDOW_MS = 2000       # Unconfirmed detections older than this are dropped
+
+_UNKNOWN_DEVICE = "unknown"     # Firmware from before devices sent their id
+
+
+class _RoomWindow:
+    """A room's recent unconfirmed detections and confirmed bounces, both sorted by time."""
+
+    def __init__(self):
+        self.times: List[int] = []
+        self.devices: List[str] = []
+        self.events: List[Dict[str, Any]] = []
+        self.confirmed: List[int] = []
+
+    def prune(self, before_ms: int) -> int:
+        """Drop everything older than `before_ms`; returns how many detections went unconfirmed."""
+        i = bisect_left(self.times, before_ms)
+        if i:
+            del self.times[:i], self.devices[:i], self.events[:i]
+        j = bisect_left(self.confirmed, before_ms)
+        if j:
+            del self.confirmed[:j]
+        return i
+
+
+class EventFusion:
+    """
+    Confirms a room's bounce once `min_devices` distinct devices detected it within `tolerance_ms`.
+
+    Each room keeps a short time-sorted window of detections; a new one is placed with a
+    binary search and only its neighbours within the tolerance are looked at, so an event costs
+    O(log n) plus the few detections of the same bounce. A bounce is confirmed as soon as the
+    last device needed reports it - no timer, the added latency is just the spread between
+    devices. Detections of an already confirmed bounce (e.g. a third mic) are absorbed.
+
+    Times are the events' backend capture times, so only devices with a synced clock can
+    confirm bounces. Receipt times won't do: a device draining its offline queue sends hours
+    of bounces in one batch, all received at about the same time. Unsynced detections are
+    counted and ignored.
+    """
+
+    def __init__(self, cfg: Dict[str, Any]):
+        self.min_devices = cfg.get("min_devices", _DEFAULT_MIN_DEVICES)
+        self.tolerance_ms = cfg.get("tolerance_ms", _DEFAULT_TOLERANCE_MS)
+        self.window_ms = cfg.get("window_ms", _DEFAULT_WINDOW_MS)
+        self.room_min_devices = cfg.get("rooms", {})  # room -> min_devices, for rooms differing from the default
+        self.windows: Dict[str, _RoomWindow] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self.warned_unsynced = set()
+
+    def _count(self, room: str, key: str, n: int = 1):
+        stats = self.stats.setdefault(room, {"detections": 0, "confirmed": 0, "absorbed": 0, "unconfirmed": 0,
+                                                 "unsynced": 0})
+        stats[key] += n
+
+    def add(self, room: str, event: Dict[str, Any], at_ms: Optional[int]) -> Optional[Dict[str, Any]]:
+        """Account for a detection captured at `at_ms` (None if unknown); returns the bounce event it confirms, if any."""
+        self._count(room, "detections")
+        min_devices = self.room_min_devices.get(room, self.min_devices)
+        if min_devices <= 1:
+            self._count(room, "confirmed")
+            return event
+
+        if at_ms is None:
+            self._count(room, "unsynced")
+            device = event.get("device_id", _UNKNOWN_DEVICE)
+            if device not in self.warned_unsynced:
+                self.warned_unsynced.add(device)
+                logger.warning(f"Ignoring detections of {device} in room {room} until its clock is synced")
+            return None
+
+        window = self.windows.setdefault(room, _RoomWindow())
+        # Late (queued) events may arrive out of order - prune relative to the newest time seen
+        newest_ms = max(at_ms, window.times[-1] if window.times else at_ms)
+        self._count(room, "unconfirmed", window.prune(newest_ms - self.window_ms))
+
+        confirmed = window.confirmed
+        i = bisect_left(confirmed, at_ms - self.tolerance_ms)
+        if i < len(confirmed) and confirmed[i] <= at_ms + self.tolerance_ms:
+            self._count(room, "absorbed")
+            return None
+
+        i = bisect_right(window.times, at_ms)
+        window.times.insert(i, at_ms)
+        window.devices.insert(i, event.get("device_id", _UNKNOWN_DEVICE))
+        window.events.insert(i, event)
+
+        lo = bisect_left(window.times, at_ms - self.tolerance_ms)
+        hi = bisect_right(window.times, at_ms + self.tolerance_ms)
+        devices = set(window.devices[lo:hi])
+        if len(devices) < min_devices:
+            return None
+
+        # The earliest detection stands for the bounce; the whole cluster is consumed
+        fused = dict(window.events[lo])
+        fused["devices"] = sorted(devices)
+        insort(confirmed, window.times[lo])
+        del window.times[lo:hi], window.devices[lo:hi], window.events[lo:hi]
+        self._count(room, "confirmed")
+        return fused
+
+    def forget(self, room: str):
+        self.windows.pop(room, None)
+
+    def asdict(self) -> Dict[str, Any]:
+        return {
+            "min_devices": self.min_devices,
+            "tolerance_ms": self.tolerance_ms,
+            "rooms": {room: {"min_devices": self.room_min_devices.get(room, self.min_devices), **stats}
+                      for room, stats in self.stats.items()},
+        }
@@ -0,0 +1,152 @@
+"""Priority lanes and per-device admission control for what devices post to the backend."""
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+_DEFAULT_AUDIO_RATE_PER_DEVICE = 30.0   # Frames/s - a device in debug mode sends 25 (40ms windows)
+_DEFAULT_AUDIO_BURST = 50               # Frames a device may send above its rate, e.g. after a stall
+_DEFAULT_AUDIO_QUEUE_MAX_FRAMES = 200   # Admitted frames waiting to be published, all devices
+_DEFAULT_MAX_DEVICES = 256              # Tracked devices (ids are client supplied) - least recently seen go first
+_IDLE_REFILL_PERIODS = 3                # A bucket idle this many full refills is as good as new; forget it
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class IngestScheduler:
+    """
+    Two lanes into the backend: control events (bounces), and bulk debug audio frames.
+
+    Control events are handled inline, and while any is in flight the audio lane is paused -
+    control traffic has strict priority. Audio frames are admitted per device through a token
+    bucket, before their body is even parsed, then published from a bounded queue by a
+    background consumer. Frames over their device's rate or arriving at a full queue are
+    refused (the caller answers 429) and counted per device.
+
+    Device ids come from the clients, so per-device state is bounded: devices idle for a few
+    refill periods are forgotten (their bucket would be full again anyway), and past
+    `max_devices` the least recently seen ones go. Totals keep counting across evictions.
+    """
+
+    def __init__(self, cfg: Dict[str, Any], publish_audio: Callable[[Dict[str, Any]], Awaitable[None]]):
+        self.audio_rate_per_device = cfg.get("audio_rate_per_device", _DEFAULT_AUDIO_RATE_PER_DEVICE)
+        self.audio_burst = cfg.get("audio_burst", _DEFAULT_AUDIO_BURST)
+        self.audio_queue_max_frames = cfg.get("audio_queue_max_frames", _DEFAULT_AUDIO_QUEUE_MAX_FRAMES)
+        self.max_devices = cfg.get("max_devices", _DEFAULT_MAX_DEVICES)
+        self.idle_secs = _IDLE_REFILL_PERIODS * self.audio_burst / self.audio_rate_per_device
+        self.publish_audio = publish_audio
+
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()  # Least recently seen first
+        self.audio_queue = deque()
+        self.audio_queued = asyncio.Event()
+        self.control_idle = asyncio.Event()
+        self.control_idle.set()
+        self.control_in_flight = 0
+        self.consumer_task = None
+
+        self.control_events = 0
+        self.audio_queue_max_depth = 0
+        self.device_stats: Dict[str, Dict[str, int]] = {}
+        self.totals = {"accepted": 0, "rate_limited": 0, "shed": 0}
+
+    def start(self):
+        self.consumer_task = asyncio.create_task(self._drain_audio())
+
+    async def close(self):
+        if self.consumer_task is not None:
+            self.consumer_task.cancel()
+
+    @asynccontextmanager
+    async def control(self):
+        """Wraps the handling of control events; the audio lane waits until none is in flight."""
+        self.control_events += 1
+        self.control_in_flight += 1
+        self.control_idle.clear()
+        try:
+            yield
+        finally:
+            self.control_in_flight -= 1
+            if self.control_in_flight == 0:
+                self.control_idle.set()
+
+    def admit_audio(self, device: str) -> bool:
+        now = time.monotonic()
+        bucket = self.buckets.get(device)
+        if bucket is None:
+            bucket = self.buckets[device] = TokenBucket(self.audio_rate_per_device, self.audio_burst)
+        else:
+            self.buckets.move_to_end(device)
+        # Frames shed at a full queue count against the device's rate too
+        if not bucket.take(now):
+            result = "rate_limited"
+        elif len(self.audio_queue) >= self.audio_queue_max_frames:
+            result = "shed"
+        else:
+            result = "accepted"
+
+        stats = self.device_stats.setdefault(device, {"accepted": 0, "rate_limited": 0, "shed": 0})
+        stats[result] += 1
+        self.totals[result] += 1
+        self._evict(now)
+        return result == "accepted"
+
+    def _evict(self, now: float):
+        while self.buckets:
+            device, bucket = next(iter(self.buckets.items()))
+            if len(self.buckets) <= self.max_devices and now - bucket.updated_at < self.idle_secs:
+                break
+            del self.buckets[device]
+            self.device_stats.pop(device, None)
+
+    def enqueue_audio(self, frame: Dict[str, Any]):
+        """Queue a frame admitted by `admit_audio()`."""
+        self.audio_queue.append(frame)
+        self.audio_queue_max_depth = max(self.audio_queue_max_depth, len(self.audio_queue))
+        self.audio_queued.set()
+
+    async def _drain_audio(self):
+        while True:
+            if not self.audio_queue:
+                self.audio_queued.clear()
+                await self.audio_queued.wait()
+            await self.control_idle.wait()
+            frame = self.audio_queue.popleft()
+            try:
+                await self.publish_audio(frame)
+            except Exception as e:
+                logger.error(f"Error publishing audio frame: {e}", exc_info=True)
+            # Let control requests in between two frames
+            await asyncio.sleep(0)
+
+    def asdict(self) -> Dict[str, Any]:
+        return {
+            "control_events": self.control_events,
+            "control_in_flight": self.control_in_flight,
+            "audio_queue_depth": len(self.audio_queue),
+            "audio_queue_max_depth": self.audio_queue_max_depth,
+            "audio_queue_max_frames": self.audio_queue_max_frames,
+            "audio_rate_per_device": self.audio_rate_per_device,
+            "audio_accepted": self.totals["accepted"],
+            "audio_rate_limited": self.totals["rate_limited"],
+            "audio_shed": self.totals["shed"],
+            "devices": self.device_stats,  # Recently seen ones
+        }
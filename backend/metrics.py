@@ -0,0 +1,76 @@
+"""Lightweight latency histograms for the backend pipeline."""
+import time
+from typing import Dict, Optional
+
+
+# Upper bounds (ms) of the histogram buckets. The last bucket catches everything above.
+_BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+def now_ms() -> int:
+    """Backend wall clock in milliseconds since the epoch."""
+    return time.time_ns() // 1_000_000
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram with O(1) recording and bucket-resolution percentiles."""
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms: Optional[float] = None
+        self.max_ms: Optional[float] = None
+
+    def record(self, value_ms: float):
+        idx = len(_BUCKET_BOUNDS_MS)
+        for i, bound in enumerate(_BUCKET_BOUNDS_MS):
+            if value_ms <= bound:
+                idx = i
+                break
+        self.counts[idx] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.min_ms = value_ms if self.min_ms is None else min(self.min_ms, value_ms)
+        self.max_ms = value_ms if self.max_ms is None else max(self.max_ms, value_ms)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th quantile (0 < q <= 1)."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return _BUCKET_BOUNDS_MS[i] if i < len(_BUCKET_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def asdict(self) -> Dict:
+        buckets = {f"le_{bound}": n for bound, n in zip(_BUCKET_BOUNDS_MS, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "min_ms": self.min_ms,
+            "max_ms": self.max_ms,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "buckets": buckets,
+        }
+
+
+class LatencyStats:
+    """A named collection of latency histograms, created on first use."""
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {}
+
+    def record(self, name: str, value_ms: float):
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+        self.histograms[name].record(value_ms)
+
+    def asdict(self) -> Dict:
+        return {name: hist.asdict() for name, hist in self.histograms.items()}
@@ -1,15 +1,27 @@
 import asyncio
 from datetime import datetime
 
+import slack_sdk.errors
 import slack_sdk.web.async_client
 
 
+# Tags each status message with its room, so it can be found again after a restart or failover
+_METADATA_EVENT_TYPE = "pingpong_room_state"
+_HISTORY_SEARCH_LIMIT = 50
+# chat.update errors meaning the message is gone; anything else (rate limits, auth...) is raised,
+# posting a new message then would leave the room with two
+_MESSAGE_GONE_ERRORS = ("message_not_found", "cant_update_message")
+
+
 class SlackNotifier:
+    """Keeps one status message per room in the channel, updated on every state change."""
+
     def __init__(self, cfg):
         self.cfg = cfg
         self.channel_name = cfg["channel"]
         self.client = slack_sdk.web.async_client.AsyncWebClient(token=cfg["token"])
         self.assets_url = cfg["assets_url"].rstrip("/")
+        self.room_message_ts = {}
 
     def _asset_url(self, asset_filename):
         return f"{self.assets_url}/{asset_filename}"
@@ -29,16 +41,24 @@ class SlackNotifier:
 
 
     async def _get_historical_messages(self, limit=10):
-        resp = await self.client.conversations_history(channel=self.channel_id, limit=limit)
+        resp = await self.client.conversations_history(channel=self.channel_id, limit=limit, include_all_metadata=True)
         return resp["messages"]
 
+    async def _find_room_message_ts(self, room):
+        for message in await self._get_historical_messages(_HISTORY_SEARCH_LIMIT):
+            metadata = message.get("metadata", {})
+            if (message.get("bot_id") == self.bot_id and metadata.get("event_type") == _METADATA_EVENT_TYPE
+                    and metadata.get("event_payload", {}).get("room") == room):
+                return message["ts"]
+        return None
+
     async def notify(self, room_state):
         blocks = [ 
             {
                 "type": "section",
                 "text": {
                     "type": "mrkdwn",
-                    "text": "Looks like we have some news regarding the pingpong room:"
+                    "text": f"Looks like we have some news regarding the pingpong room *{room_state.room}*:"
                 }
             },
             {
@@ -48,7 +68,7 @@ class SlackNotifier:
                 "type": "section",
                 "text": {
                     "type": "mrkdwn",
-                    "text": f"The room is now {room_state.state}! Since <!date^{room_state.last_state_change_time:.0f}^{{time}}| >",
+                    "text": f"Room *{room_state.room}* is now {room_state.state}! Since <!date^{room_state.last_state_change_time:.0f}^{{time}}| >",
                 },
                 "accessory": {
                     "type": "image",
@@ -58,13 +78,25 @@ class SlackNotifier:
             },
         ]
 
-        await self.post_or_update(blocks)
+        await self.post_or_update(room_state.room, blocks)
+
+    async def post_or_update(self, room, blocks):
+        """Update the room's status message, or post it if it isn't in the recent history."""
+        ts = self.room_message_ts.get(room)
+        if ts is None:
+            ts = await self._find_room_message_ts(room)
 
-    async def post_or_update(self, blocks):
-        last_messages = await self._get_historical_messages(1)
-        should_update = "bot_id" in last_messages[0] and last_messages[0]["bot_id"] == self.bot_id
+        text = f"Pingpong room {room} update"  # Notification fallback
+        metadata = {"event_type": _METADATA_EVENT_TYPE, "event_payload": {"room": room}}
+        if ts is not None:
+            try:
+                await self.client.chat_update(channel=self.channel_id, ts=ts, blocks=blocks, text=text, metadata=metadata)
+                self.room_message_ts[room] = ts
+                return
+            except slack_sdk.errors.SlackApiError as e:
+                if e.response["error"] not in _MESSAGE_GONE_ERRORS:
+                    raise
+                # Deleted meanwhile - post a new one
 
-        if should_update:
-            await self.client.chat_update(channel=self.channel_id, ts=last_messages[0]["ts"], blocks=blocks)
-        else:
-            await self.client.chat_postMessage(channel=self.channel_id, blocks=blocks)
+        resp = await self.client.chat_postMessage(channel=self.channel_id, blocks=blocks, text=text, metadata=metadata)
+        self.room_message_ts[room] = resp["ts"]
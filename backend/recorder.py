@@ -0,0 +1,83 @@
+"""Records what devices post to the backend, for tools/replay_session.py."""
+import json
+import logging
+import os
+import time
+import wave
+from typing import Any, Dict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+_DEFAULT_PATH = "recordings"
+_DEFAULT_SAMPLE_RATE = 16000
+
+EVENTS_FILE = "events.jsonl"        # {"received_at_ms", "event"} per line
+AUDIO_FILE = "audio.wav"            # 16-bit mono, the debug frames back to back
+AUDIO_INDEX_FILE = "audio.jsonl"    # {"received_at_ms", "offset", "n", ...frame fields} per frame
+
+
+class SessionRecorder:
+    """
+    Appends every received event and debug audio frame to a recording directory.
+
+    Events keep their original payload next to the receipt time. Audio frames go to one WAV
+    file, with the receipt time and sample offset of each frame in an index next to it, so a
+    replay can post the frames again as they came. Every write is flushed (and the WAV header
+    patched) right away - a recording stays readable if the backend is killed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.events_file = open(os.path.join(path, EVENTS_FILE), "a")
+        self.audio_index_file = open(os.path.join(path, AUDIO_INDEX_FILE), "a")
+        self.wav_file = None
+        self.wav = None
+        self.sample_rate = None
+        self.audio_offset = 0
+
+    def record_event(self, event: Any, received_at_ms: int):
+        self.events_file.write(json.dumps({"received_at_ms": received_at_ms, "event": event}) + "\n")
+        self.events_file.flush()
+
+    def record_audio(self, frame: Dict[str, Any], received_at_ms: int):
+        sample_rate = frame.get("sample_rate") or _DEFAULT_SAMPLE_RATE
+        if self.wav is None:
+            self.sample_rate = sample_rate
+            self.wav_file = open(os.path.join(self.path, AUDIO_FILE), "wb")
+            self.wav = wave.open(self.wav_file, "wb")
+            self.wav.setnchannels(1)
+            self.wav.setsampwidth(2)
+            self.wav.setframerate(sample_rate)
+        elif sample_rate != self.sample_rate:
+            logger.warning(f"Not recording audio frame at {sample_rate}Hz, the recording is at {self.sample_rate}Hz")
+            return
+
+        samples = frame["samples"]
+        # Writing a frame patches the header's length, so the file is valid at any time
+        self.wav.writeframes(np.asarray(samples, dtype="<i2").tobytes())
+        self.wav_file.flush()
+        index = {key: value for key, value in frame.items() if key != "samples"}
+        index.update(received_at_ms=received_at_ms, offset=self.audio_offset, n=len(samples))
+        self.audio_index_file.write(json.dumps(index) + "\n")
+        self.audio_index_file.flush()
+        self.audio_offset += len(samples)
+
+    def close(self):
+        self.events_file.close()
+        self.audio_index_file.close()
+        if self.wav is not None:
+            self.wav.close()
+            self.wav_file.close()
+
+
+def build_recorder(cfg: Dict[str, Any], worker_id: str):
+    """A recorder in a new directory per run and worker, or None unless recording is enabled."""
+    if not cfg.get("enabled", False):
+        return None
+    path = os.path.join(cfg.get("path", _DEFAULT_PATH), f"{time.strftime('%Y%m%d-%H%M%S')}-{worker_id}")
+    logger.info(f"Recording events and audio to {path}")
+    return SessionRecorder(path)
@@ -1,22 +1,33 @@
 import asyncio
 from contextlib import asynccontextmanager
+from functools import partial
 import logging
 import os  
 import pathlib
-from typing import List
+import socket
+from typing import Optional
 from urllib.parse import urlparse, urlunparse
 
 
 import dotenv
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 import ngrok
 import uvicorn
 
+from audio_stream import AudioStreamHub
 from config_utils import load_config
 from controller import Controller
+import device_configs
+from ingest import IngestScheduler
+from metrics import now_ms
 from notifier import SlackNotifier
+from recorder import build_recorder
+from shared_state import (
+    AUDIO_FRAMES_CHANNEL, DEFAULT_ROOM, ROOM_SESSION_CHANNEL, ROOM_STATE_CHANNEL,
+    build_device_config_store, build_shared_state,
+)
 
 dotenv.load_dotenv()
 
@@ -31,14 +42,38 @@ if not _ASSETS_FOLDER.exists():
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await _use_ngrok_if_needed(app.state.cfg)
+    app.state.ngrok_session, app.state.ngrok_listener = await _use_ngrok_if_needed(app.state.cfg)
     
+    # Each uvicorn worker runs its own lifespan; rooms, state changes and audio frames are shared through here
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    app.state.pubsub, app.state.room_store = build_shared_state(app.state.cfg.get("shared_state", {}), worker_id)
+    app.state.pubsub.subscribe(AUDIO_FRAMES_CHANNEL, app.state.audio_hub.broadcast)
+    app.state.pubsub.subscribe(ROOM_STATE_CHANNEL, app.state.room_state_viewers.broadcast)
+    app.state.pubsub.subscribe(ROOM_SESSION_CHANNEL, app.state.room_state_viewers.broadcast)
+    await app.state.pubsub.start()
+    app.state.device_configs = build_device_config_store(app.state.cfg.get("shared_state", {}))
+    app.state.recorder = build_recorder(app.state.cfg.get("recording", {}), worker_id)
+    app.state.ingest = IngestScheduler(app.state.cfg.get("ingest", {}), partial(app.state.pubsub.publish, AUDIO_FRAMES_CHANNEL))
+    app.state.ingest.start()
+
     app.state.notifier = SlackNotifier(app.state.cfg["notifier"])
     await app.state.notifier.init()
-    app.state.controller = Controller(app.state.cfg["controller"], app.state.notifier)
+    app.state.controller = Controller(
+        app.state.cfg["controller"], app.state.notifier,
+        store=app.state.room_store, pubsub=app.state.pubsub, worker_id=worker_id,
+    )
+    app.state.controller.start()
     yield
-    await app.state.ngrok_listener.close()
-    await app.state.ngrok_session.close()
+    await app.state.ingest.close()
+    await app.state.controller.close()
+    await app.state.pubsub.close()
+    await app.state.room_store.close()
+    await app.state.device_configs.close()
+    if app.state.recorder is not None:
+        app.state.recorder.close()
+    if app.state.ngrok_listener is not None:
+        await app.state.ngrok_listener.close()
+        await app.state.ngrok_session.close()
 
 
 async def expose_server_with_ngrok(port):
@@ -46,15 +81,21 @@ async def expose_server_with_ngrok(port):
     listener = await session.http_endpoint().listen()
     print (f"Ngrok ingress established at {listener.url()}")
     listener.forward(f"localhost:{port}")
-    return listener.url()
+    return session, listener
 
 
 async def _use_ngrok_if_needed(cfg):
+    """The ngrok session and listener, or (None, None) if the server isn't exposed."""
     if "use_ngrok" not in cfg["server"] or not cfg["server"]["use_ngrok"]:
-        return
+        return None, None
+    if cfg["server"].get("workers", 1) > 1:
+        # Every worker would open its own tunnel; put a single ingress in front of the workers instead
+        logger.warning("use_ngrok is only supported with a single worker, not exposing the server")
+        return None, None
 
     logger.info("Exposing server with ngrok")
-    external_server_url = await expose_server_with_ngrok(cfg["server"]["port"])
+    session, listener = await expose_server_with_ngrok(cfg["server"]["port"])
+    external_server_url = listener.url()
 
     parsed_url = urlparse(cfg["notifier"]["assets_url"])
     parsed_ngrok_url = urlparse(external_server_url)
@@ -66,56 +107,208 @@ async def _use_ngrok_if_needed(cfg):
         None, None, None
     ))
     cfg["notifier"]["assets_url"] = new_assets_url
+    return session, listener
+
+
+class RoomStateViewers:
+    """WebSocket viewers of room state changes, optionally following a single room."""
+
+    def __init__(self):
+        self.viewers = {}  # websocket -> room, or None for every room
+
+    def add(self, websocket: WebSocket, room=None):
+        self.viewers[websocket] = room
+
+    def remove(self, websocket: WebSocket):
+        self.viewers.pop(websocket, None)
+
+    async def broadcast(self, state):
+        for websocket, room in list(self.viewers.items()):
+            if room is not None and room != state["room"]:
+                continue
+            try:
+                await websocket.send_json(state)
+            except Exception as e:
+                logger.warning(f"Failed to send to WebSocket client: {e}")
+                self.remove(websocket)
 
 
 def build_app(cfg):
     app = FastAPI(lifespan=lifespan)
     app.state.cfg = cfg
     
-    # WebSocket connections for microphone test streaming
-    active_ws_connections: List[WebSocket] = []
+    # WebSocket viewers of the microphone test stream and of room states. Frames and state
+    # changes arrive through the shared pub/sub, so viewers on any worker see them.
+    app.state.audio_hub = audio_hub = AudioStreamHub()
+    app.state.room_state_viewers = room_state_viewers = RoomStateViewers()
 
     @app.get("/ping")
     async def ping():
         logger.info("Ping received")
         return JSONResponse(content={"status": "ok"})
 
+    @app.post("/clock-sync")
+    async def clock_sync(request: Request):
+        """NTP-style exchange: echo the device's t0 with backend receive (t1) and send (t2) times"""
+        t1 = now_ms()
+        try:
+            data = await request.json()
+        except Exception:
+            logger.error("Invalid JSON in clock sync: %s", await request.body())
+            return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+
+        return JSONResponse(content={"t0": data.get("t0"), "t1": t1, "t2": now_ms()})
+
     @app.post("/pingpong-event")
     async def pingpong_event(request: Request):
+        received_at_ms = now_ms()
         try:
             data = await request.json()
         except Exception:
             logger.error("Invalid JSON: %s", await request.body())
             return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
         
+        if app.state.recorder is not None:
+            app.state.recorder.record_event(data, received_at_ms)
         try:
-            await app.state.controller.handle_event(data)
+            async with app.state.ingest.control():
+                await app.state.controller.handle_event(data, received_at_ms=received_at_ms)
             return JSONResponse(content={"status": "ok"})
         except Exception as e:
             logger.error(e, exc_info=True)
             return JSONResponse(status_code=500, content={"error": "Error handling event"})
 
+    @app.post("/pingpong-events")
+    async def pingpong_events(request: Request):
+        """Batch of events, e.g. drained from a device's offline queue. Handled in order."""
+        received_at_ms = now_ms()
+        try:
+            data = await request.json()
+        except Exception:
+            logger.error("Invalid JSON: %s", await request.body())
+            return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+
+        events = data.get("events") if isinstance(data, dict) else None
+        if not isinstance(events, list):
+            return JSONResponse(status_code=400, content={"error": "Missing 'events' list"})
+        # All or nothing for malformed batches; a batch failing later is resent whole, and
+        # the events already handled are recognised by their `event_id`
+        for i, event in enumerate(events):
+            try:
+                app.state.controller.validate_event(event)
+            except ValueError as e:
+                return JSONResponse(status_code=400, content={"error": f"Event {i}: {e}"})
+
+        try:
+            async with app.state.ingest.control():
+                for event in events:
+                    if app.state.recorder is not None:
+                        app.state.recorder.record_event(event, received_at_ms)
+                    await app.state.controller.handle_event(event, received_at_ms=received_at_ms)
+            return JSONResponse(content={"status": "ok", "handled": len(events)})
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            return JSONResponse(status_code=500, content={"error": "Error handling events"})
+
     @app.get("/room-state")
-    async def room_state():
-        return JSONResponse(content=app.state.controller.get_room_state())
+    async def room_state(room: str = DEFAULT_ROOM):
+        return JSONResponse(content=await app.state.controller.get_room_state(room))
+
+    @app.get("/session-stats")
+    async def session_stats(room: str = DEFAULT_ROOM):
+        return JSONResponse(content=await app.state.controller.get_session_stats(room))
+
+    @app.get("/latency-stats")
+    async def latency_stats():
+        return JSONResponse(content=app.state.controller.get_latency_stats())
+
+    @app.get("/fusion-stats")
+    async def fusion_stats():
+        return JSONResponse(content=app.state.controller.get_fusion_stats())
+
+    @app.get("/ingest-stats")
+    async def ingest_stats():
+        return JSONResponse(content=app.state.ingest.asdict())
+
+    @app.get("/detector-configs")
+    async def list_detector_configs():
+        return JSONResponse(content={"devices": await app.state.device_configs.all()})
+
+    @app.get("/detector-config/{device_id}")
+    async def get_detector_config(device_id: str, version: Optional[int] = None):
+        """Detector overrides of a device. Devices poll with `?version=<applied version>` and get a 304 until it changes."""
+        entry = await app.state.device_configs.get(device_id)
+        if entry is None:
+            entry = {"device_id": device_id, "version": 0, "config": {}, "updated_at": None}
+        if version is not None and version == entry["version"]:
+            return Response(status_code=304)
+        return JSONResponse(content=entry)
+
+    @app.put("/detector-config/{device_id}")
+    async def put_detector_config(device_id: str, request: Request):
+        """Replace a device's detector overrides (keys missing fall back to the device's config.json)."""
+        try:
+            data = await request.json()
+        except Exception:
+            logger.error("Invalid JSON in detector config: %s", await request.body())
+            return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+
+        try:
+            config = device_configs.validate(data)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+
+        entry = await app.state.device_configs.put(device_id, config)
+        logger.info(f"Detector config of {device_id} is now version {entry['version']}: {config}")
+        return JSONResponse(content=entry)
+
+    @app.websocket("/ws/room-state")
+    async def room_state_ws(websocket: WebSocket):
+        """Current state of `?room=` (default room if not given) followed by every change and
+        rally-start / rally-end event. Without `?room=` those of all rooms are sent."""
+        room = websocket.query_params.get("room")
+        await websocket.accept()
+        await websocket.send_json(await app.state.controller.get_room_state(room or DEFAULT_ROOM))
+        room_state_viewers.add(websocket, room)
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            room_state_viewers.remove(websocket)
 
     @app.websocket("/ws/audio-stream")
     async def audio_stream_ws(websocket: WebSocket):
-        """WebSocket endpoint for streaming audio data to web clients"""
+        """WebSocket endpoint for streaming audio data to web clients.
+
+        `?pps=<points per second>` subscribes to a min/max envelope decimated server side;
+        without it the raw device frames are forwarded.
+        """
+        try:
+            points_per_second = int(websocket.query_params["pps"]) if websocket.query_params.get("pps") else None
+        except ValueError:
+            points_per_second = None
+        if points_per_second is not None and points_per_second <= 0:
+            points_per_second = None
+
         await websocket.accept()
-        active_ws_connections.append(websocket)
-        logger.info(f"WebSocket client connected. Active connections: {len(active_ws_connections)}")
+        audio_hub.subscribe(websocket, points_per_second)
+        logger.info(f"WebSocket client connected (pps={points_per_second}). Active connections: {audio_hub.num_clients}")
         try:
             # Keep connection alive and wait for messages (or disconnection)
             while True:
                 await websocket.receive_text()
         except WebSocketDisconnect:
-            active_ws_connections.remove(websocket)
-            logger.info(f"WebSocket client disconnected. Active connections: {len(active_ws_connections)}")
+            audio_hub.unsubscribe(websocket)
+            logger.info(f"WebSocket client disconnected. Active connections: {audio_hub.num_clients}")
     
     @app.post("/audio-samples")
     async def receive_audio_samples(request: Request):
         """Receive audio samples from ESP32 device and broadcast to WebSocket clients"""
+        # Admission before parsing, so refused frames cost next to nothing
+        device = request.headers.get("X-Device-Id") or request.client.host
+        if not app.state.ingest.admit_audio(device):
+            return JSONResponse(status_code=429, content={"error": "Audio frame refused, over rate or backend busy"},
+                                headers={"Retry-After": "1"})
         try:
             data = await request.json()
         except Exception:
@@ -124,23 +317,15 @@ def build_app(cfg):
         
         if "samples" not in data:
             return JSONResponse(status_code=400, content={"error": "Missing 'samples' field"})
+        data.setdefault("device_id", device)
+        if app.state.recorder is not None:
+            app.state.recorder.record_audio(data, now_ms())
         
-        # Broadcast to all connected WebSocket clients
-        if active_ws_connections:
-            disconnected = []
-            for connection in active_ws_connections:
-                try:
-                    await connection.send_json(data)
-                except Exception as e:
-                    logger.warning(f"Failed to send to WebSocket client: {e}")
-                    disconnected.append(connection)
-            
-            # Remove disconnected clients
-            for conn in disconnected:
-                if conn in active_ws_connections:
-                    active_ws_connections.remove(conn)
+        # Published in the background, after pending control events. Every worker broadcasts
+        # to its own WebSocket clients, decimated once per resolution
+        app.state.ingest.enqueue_audio(data)
         
-        return JSONResponse(content={"status": "ok", "clients": len(active_ws_connections)})
+        return JSONResponse(content={"status": "ok", "clients": audio_hub.num_clients})
 
     app.mount("/assets", StaticFiles(directory=_ASSETS_FOLDER), name="assets")
 
@@ -153,12 +338,16 @@ app = build_app(cfg)
 if __name__ == "__main__":
     try: 
         reload = os.getenv("RELOAD", "").strip().lower() in ("1", "true", "yes")
+        workers = cfg["server"].get("workers", 1)
+        if workers > 1 and cfg.get("shared_state", {}).get("backend", "local") == "local":
+            raise ValueError("Several workers need a shared state backend other than 'local' (e.g. 'sqlite')")
         uvicorn.run(
             "server:app",
             host=cfg["server"]["ip"],
             port=cfg["server"]["port"],
             log_level="debug",
             reload=reload,
+            workers=None if reload else workers,
         )
     finally:
         try:
@@ -0,0 +1,127 @@
+"""Online rally / game / session tracking over a room's bounce stream."""
+from typing import Any, Dict, List, Optional
+
+
+_DEFAULT_RALLY_GAP_MS = 2500      # A longer pause between bounces ends the rally
+_DEFAULT_MIN_RALLY_BOUNCES = 3    # Fewer bounces are a serve into the net, a stray ball...
+_DEFAULT_GAME_GAP_MS = 60000      # A longer pause between rallies starts a new game
+
+# Everything a room's session state consists of - also the restorable part of its snapshot
+_INITIAL_STATS = {
+    "bounces": 0,
+    "rallies": 0,
+    "rally_bounces": 0,
+    "rally_duration_ms": 0,
+    "longest_rally_bounces": 0,
+    "longest_rally_ms": 0,
+    "games": 0,
+    "sessions": 0,
+    # Current session (the room being taken until it's freed)
+    "session_start_ms": None,
+    "session_bounces": 0,
+    "session_games": 0,
+    # Current run of bounces, a rally once it reaches the minimum length
+    "run_start_ms": None,
+    "run_bounces": 0,
+    "in_rally": False,
+    "last_bounce_ms": None,
+    "last_rally_end_ms": None,
+}
+
+
+class RoomSession:
+    """
+    Rallies, games and sessions of one room, updated in O(1) per bounce with constant memory.
+
+    A rally is a run of at least `min_rally_bounces` bounces with no gap above `rally_gap_ms`.
+    Rallies less than `game_gap_ms` apart belong to the same game, and a session lasts while
+    the room is taken. Times are backend ms - the bounce's capture time when the device clock
+    is synced, so a batch of queued events is analysed as it was played.
+    """
+
+    def __init__(self, room: str, cfg: Dict[str, Any], snapshot: Optional[Dict[str, Any]] = None):
+        self.room = room
+        self.rally_gap_ms = cfg.get("rally_gap_ms", _DEFAULT_RALLY_GAP_MS)
+        self.min_rally_bounces = cfg.get("min_rally_bounces", _DEFAULT_MIN_RALLY_BOUNCES)
+        self.game_gap_ms = cfg.get("game_gap_ms", _DEFAULT_GAME_GAP_MS)
+
+        self.stats = dict(_INITIAL_STATS)
+        if snapshot is not None:
+            self.stats.update((key, snapshot[key]) for key in _INITIAL_STATS if key in snapshot)
+
+    def on_bounce(self, at_ms: int) -> List[Dict[str, Any]]:
+        """Account for a bounce; returns the rally-start / rally-end events it caused."""
+        s = self.stats
+        events = []
+        if s["last_bounce_ms"] is not None and at_ms - s["last_bounce_ms"] > self.rally_gap_ms:
+            events += self._end_run()
+
+        if s["session_start_ms"] is None:
+            s["sessions"] += 1
+            s["session_start_ms"] = at_ms
+            s["session_bounces"] = 0
+            s["session_games"] = 0
+
+        if s["run_bounces"] == 0:
+            s["run_start_ms"] = at_ms
+        s["run_bounces"] += 1
+        s["bounces"] += 1
+        s["session_bounces"] += 1
+        # Late (queued) events may arrive out of order - never move backwards
+        s["last_bounce_ms"] = at_ms if s["last_bounce_ms"] is None else max(s["last_bounce_ms"], at_ms)
+
+        if s["run_bounces"] == self.min_rally_bounces:
+            if s["last_rally_end_ms"] is None or s["run_start_ms"] - s["last_rally_end_ms"] > self.game_gap_ms:
+                s["games"] += 1
+                s["session_games"] += 1
+            s["in_rally"] = True
+            events.append(self._event("rally-start", s["run_start_ms"], game=s["games"]))
+        return events
+
+    def expire(self, now_ms: int) -> List[Dict[str, Any]]:
+        """End the current rally if its gap already ran out, without waiting for the next bounce."""
+        s = self.stats
+        if s["run_bounces"] and now_ms - s["last_bounce_ms"] > self.rally_gap_ms:
+            return self._end_run()
+        return []
+
+    def end_session(self) -> List[Dict[str, Any]]:
+        """The room was freed: close the current rally and session."""
+        events = self._end_run()
+        self.stats["session_start_ms"] = None
+        self.stats["last_rally_end_ms"] = None
+        return events
+
+    def _end_run(self) -> List[Dict[str, Any]]:
+        s = self.stats
+        events = []
+        if s["in_rally"]:
+            bounces = s["run_bounces"]
+            duration_ms = s["last_bounce_ms"] - s["run_start_ms"]
+            s["rallies"] += 1
+            s["rally_bounces"] += bounces
+            s["rally_duration_ms"] += duration_ms
+            s["longest_rally_bounces"] = max(s["longest_rally_bounces"], bounces)
+            s["longest_rally_ms"] = max(s["longest_rally_ms"], duration_ms)
+            s["last_rally_end_ms"] = s["last_bounce_ms"]
+            s["in_rally"] = False
+            events.append(self._event("rally-end", s["last_bounce_ms"], bounces=bounces, duration_ms=duration_ms))
+        s["run_bounces"] = 0
+        s["run_start_ms"] = None
+        return events
+
+    def _event(self, event_type: str, at_ms: int, **fields) -> Dict[str, Any]:
+        return {"type": event_type, "room": self.room, "at_ms": at_ms, **fields}
+
+    def asdict(self) -> Dict[str, Any]:
+        s = self.stats
+        session_ms = (s["last_bounce_ms"] - s["session_start_ms"]) if s["session_start_ms"] is not None else 0
+        return {
+            "room": self.room,
+            **s,
+            "avg_rally_bounces": s["rally_bounces"] / s["rallies"] if s["rallies"] else None,
+            "avg_rally_secs": s["rally_duration_ms"] / s["rallies"] / 1000 if s["rallies"] else None,
+            "rally_bounce_rate_hz": s["rally_bounces"] / (s["rally_duration_ms"] / 1000) if s["rally_duration_ms"] else None,
+            "session_bounce_rate_per_min": s["session_bounces"] / (session_ms / 60000) if session_ms else None,
+            "current_rally_bounces": s["run_bounces"] if s["in_rally"] else 0,
+        }
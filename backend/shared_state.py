@@ -0,0 +1,431 @@
+"""
+State shared between backend workers: a pub/sub bus, a store of room states and ownership
+leases, and the per-device detector config overrides.
+
+Each room is owned by exactly one worker at a time (a lease renewed by the owner). The owner
+runs the room's countdown and notifications; other workers forward the room's events to it
+over pub/sub. State changes are published too, so WebSocket viewers connected to any
+worker see them. Debug audio frames stay on the worker that received them unless
+`share_audio` is set: they're by far the most frequent messages, and on the sqlite bus every
+one would take the write lock events and leases need, for viewers that are rarely there.
+
+`local` keeps everything in-process (a single worker). `sqlite` shares it through a SQLite
+file in WAL mode, so it works across the workers of one host.
+"""
+from abc import ABC, abstractmethod
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_ROOM = "default"
+
+ROOM_EVENTS_CHANNEL = "room-events"
+ROOM_STATE_CHANNEL = "room-state"
+ROOM_SESSION_CHANNEL = "room-session"
+AUDIO_FRAMES_CHANNEL = "audio-frames"
+
+_DEFAULT_BACKEND = "local"
+_DEFAULT_DB_PATH = "/tmp/pingpong-shared-state.sqlite"
+_DEFAULT_POLL_INTERVAL_MS = 20
+_DEFAULT_RETENTION_SECS = 60
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class PubSub:
+    """
+    Fire-and-forget messages on named channels. A worker's own messages are delivered to
+    its handlers directly; only messages from other workers go through the backend.
+    """
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self.handlers: Dict[str, List[Handler]] = {}
+
+    def subscribe(self, channel: str, handler: Handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        await self._dispatch(channel, message)
+
+    async def _dispatch(self, channel: str, message: Dict[str, Any]):
+        for handler in self.handlers.get(channel, ()):
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error(f"Error handling message on '{channel}': {e}", exc_info=True)
+
+
+class LocalPubSub(PubSub):
+    """In-process stand-in: with a single worker every message is a local one."""
+
+
+class SQLitePubSub(PubSub):
+    """Messages appended to a SQLite table, polled by every worker. `local_channels` aren't shared."""
+
+    def __init__(self, worker_id: str, path: str, poll_interval_ms: int = _DEFAULT_POLL_INTERVAL_MS,
+                 retention_secs: float = _DEFAULT_RETENTION_SECS, local_channels: Iterable[str] = ()):
+        super().__init__(worker_id)
+        self.local_channels = set(local_channels)
+        self.poll_interval_ms = poll_interval_ms
+        self.retention_secs = retention_secs
+        self.db = _connect(path)
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.poll_task: Optional[asyncio.Task] = None
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, origin TEXT NOT NULL,"
+                " payload TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    async def start(self):
+        # Only messages published from now on are of interest
+        self.last_id = await asyncio.to_thread(self._max_id)
+        self.poll_task = asyncio.create_task(self._poll_loop())
+
+    async def close(self):
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+        self.db.close()
+
+    async def publish(self, channel: str, message: Dict[str, Any]):
+        if channel not in self.local_channels:
+            await asyncio.to_thread(self._insert, channel, json.dumps(message))
+        await self._dispatch(channel, message)
+
+    def _max_id(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+    def _insert(self, channel: str, payload: str):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO messages (channel, origin, payload, created_at) VALUES (?, ?, ?, ?)",
+                (channel, self.worker_id, payload, time.time()),
+            )
+
+    def _fetch(self, channels: List[str]):
+        placeholders = ",".join("?" * len(channels))
+        with self.lock:
+            return self.db.execute(
+                f"SELECT id, channel, origin, payload FROM messages"
+                f" WHERE id > ? AND channel IN ({placeholders}) ORDER BY id",
+                (self.last_id, *channels),
+            ).fetchall()
+
+    def _cleanup(self):
+        with self.lock:
+            self.db.execute("DELETE FROM messages WHERE created_at < ?", (time.time() - self.retention_secs,))
+
+    async def _poll_loop(self):
+        last_cleanup = time.time()
+        while True:
+            await asyncio.sleep(self.poll_interval_ms / 1000)
+            channels = [channel for channel in self.handlers if channel not in self.local_channels]
+            if not channels:
+                continue
+            try:
+                rows = await asyncio.to_thread(self._fetch, channels)
+                if time.time() - last_cleanup > self.retention_secs:
+                    last_cleanup = time.time()
+                    await asyncio.to_thread(self._cleanup)
+            except sqlite3.Error as e:
+                logger.warning(f"Polling shared messages failed: {e}")
+                continue
+
+            for msg_id, channel, origin, payload in rows:
+                self.last_id = msg_id
+                if origin != self.worker_id:
+                    await self._dispatch(channel, json.loads(payload))
+
+
+class RoomStore(ABC):
+    """
+    Room states (the `RoomState.asdict()` of each room), session stats snapshots and
+    ownership leases.
+
+    `acquire` succeeds if the room is free of an owner, already owned by the caller (which
+    renews the lease) or its owner's lease expired.
+    """
+
+    @abstractmethod
+    async def acquire(self, room: str, owner: str, lease_secs: float) -> bool:
+        ...
+
+    @abstractmethod
+    async def release(self, room: str, owner: str):
+        ...
+
+    @abstractmethod
+    async def load(self, room: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def save(self, room: str, state: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def load_session_stats(self, room: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def save_session_stats(self, room: str, stats: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def orphaned_rooms(self) -> List[str]:
+        """Rooms left taken whose owner's lease expired - their countdown needs a new owner."""
+        ...
+
+    async def close(self):
+        pass
+
+
+class LocalRoomStore(RoomStore):
+
+    def __init__(self):
+        self.states: Dict[str, Dict[str, Any]] = {}
+        self.session_stats: Dict[str, Dict[str, Any]] = {}
+        self.leases: Dict[str, tuple] = {}  # room -> (owner, expires_at)
+
+    async def acquire(self, room, owner, lease_secs):
+        now = time.time()
+        current = self.leases.get(room)
+        if current is not None and current[0] != owner and current[1] > now:
+            return False
+        self.leases[room] = (owner, now + lease_secs)
+        return True
+
+    async def release(self, room, owner):
+        if self.leases.get(room, (None,))[0] == owner:
+            del self.leases[room]
+
+    async def load(self, room):
+        return self.states.get(room)
+
+    async def save(self, room, state):
+        self.states[room] = dict(state)
+
+    async def load_session_stats(self, room):
+        return self.session_stats.get(room)
+
+    async def save_session_stats(self, room, stats):
+        self.session_stats[room] = dict(stats)
+
+    async def orphaned_rooms(self):
+        now = time.time()
+        return [room for room, state in self.states.items()
+                if state["state"] == "taken" and self.leases.get(room, (None, 0))[1] <= now]
+
+
+class SQLiteRoomStore(RoomStore):
+
+    def __init__(self, path: str):
+        self.db = _connect(path)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS rooms ("
+                " room TEXT PRIMARY KEY, owner TEXT, lease_expires_at REAL NOT NULL DEFAULT 0, state TEXT)"
+            )
+            self.db.execute("CREATE TABLE IF NOT EXISTS session_stats (room TEXT PRIMARY KEY, stats TEXT NOT NULL)")
+
+    async def acquire(self, room, owner, lease_secs):
+        return await asyncio.to_thread(self._acquire, room, owner, lease_secs)
+
+    def _acquire(self, room, owner, lease_secs):
+        now = time.time()
+        with self.lock:
+            # Read first: taking the database's write lock for a room owned elsewhere is wasted
+            row = self.db.execute("SELECT owner, lease_expires_at FROM rooms WHERE room = ?", (room,)).fetchone()
+            if row is not None and row[0] not in (None, owner) and row[1] > now:
+                return False
+            # A single statement, so workers racing for the same room can't both win
+            cursor = self.db.execute(
+                "INSERT INTO rooms (room, owner, lease_expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(room) DO UPDATE SET owner = excluded.owner, lease_expires_at = excluded.lease_expires_at"
+                " WHERE rooms.owner IS NULL OR rooms.owner = excluded.owner OR rooms.lease_expires_at <= ?",
+                (room, owner, now + lease_secs, now),
+            )
+            return cursor.rowcount > 0
+
+    async def release(self, room, owner):
+        await asyncio.to_thread(self._execute,
+                                "UPDATE rooms SET owner = NULL, lease_expires_at = 0 WHERE room = ? AND owner = ?",
+                                (room, owner))
+
+    async def load(self, room):
+        row = await asyncio.to_thread(self._fetchone, "SELECT state FROM rooms WHERE room = ?", (room,))
+        return json.loads(row[0]) if row is not None and row[0] is not None else None
+
+    async def save(self, room, state):
+        await asyncio.to_thread(self._execute,
+                                "INSERT INTO rooms (room, state) VALUES (?, ?)"
+                                " ON CONFLICT(room) DO UPDATE SET state = excluded.state",
+                                (room, json.dumps(state)))
+
+    async def load_session_stats(self, room):
+        row = await asyncio.to_thread(self._fetchone, "SELECT stats FROM session_stats WHERE room = ?", (room,))
+        return json.loads(row[0]) if row is not None else None
+
+    async def save_session_stats(self, room, stats):
+        await asyncio.to_thread(self._execute,
+                                "INSERT INTO session_stats (room, stats) VALUES (?, ?)"
+                                " ON CONFLICT(room) DO UPDATE SET stats = excluded.stats",
+                                (room, json.dumps(stats)))
+
+    async def orphaned_rooms(self):
+        rows = await asyncio.to_thread(self._fetchall,
+                                       "SELECT room FROM rooms WHERE json_extract(state, '$.state') = 'taken'"
+                                       " AND lease_expires_at <= ?",
+                                       (time.time(),))
+        return [row[0] for row in rows]
+
+    async def close(self):
+        self.db.close()
+
+    def _execute(self, sql, params):
+        with self.lock:
+            self.db.execute(sql, params)
+
+    def _fetchone(self, sql, params):
+        with self.lock:
+            return self.db.execute(sql, params).fetchone()
+
+    def _fetchall(self, sql, params):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+
+class DeviceConfigStore(ABC):
+    """`{"device_id", "version", "config", "updated_at"}` per device. Versions start at 1."""
+
+    @abstractmethod
+    async def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def put(self, device_id: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def all(self) -> List[Dict[str, Any]]:
+        ...
+
+    async def close(self):
+        pass
+
+
+class LocalDeviceConfigStore(DeviceConfigStore):
+
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+    async def get(self, device_id):
+        return self.entries.get(device_id)
+
+    async def put(self, device_id, config):
+        version = self.entries[device_id]["version"] + 1 if device_id in self.entries else 1
+        self.entries[device_id] = {"device_id": device_id, "version": version, "config": config, "updated_at": time.time()}
+        return self.entries[device_id]
+
+    async def all(self):
+        return list(self.entries.values())
+
+
+class SQLiteDeviceConfigStore(DeviceConfigStore):
+
+    def __init__(self, path: str):
+        self.db = _connect(path)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS device_configs ("
+                " device_id TEXT PRIMARY KEY, version INTEGER NOT NULL, config TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    async def get(self, device_id):
+        rows = await asyncio.to_thread(self._select, "WHERE device_id = ?", (device_id,))
+        return rows[0] if rows else None
+
+    async def put(self, device_id, config):
+        return await asyncio.to_thread(self._put, device_id, config)
+
+    async def all(self):
+        return await asyncio.to_thread(self._select, "", ())
+
+    async def close(self):
+        self.db.close()
+
+    def _put(self, device_id, config):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO device_configs (device_id, version, config, updated_at) VALUES (?, 1, ?, ?)"
+                " ON CONFLICT(device_id) DO UPDATE SET version = version + 1, config = excluded.config,"
+                " updated_at = excluded.updated_at",
+                (device_id, json.dumps(config), time.time()),
+            )
+            return self._rows("WHERE device_id = ?", (device_id,))[0]
+
+    def _select(self, where, params):
+        with self.lock:
+            return self._rows(where, params)
+
+    def _rows(self, where, params):
+        rows = self.db.execute(
+            f"SELECT device_id, version, config, updated_at FROM device_configs {where} ORDER BY device_id", params
+        ).fetchall()
+        return [
+            {"device_id": device_id, "version": version, "config": json.loads(config), "updated_at": updated_at}
+            for device_id, version, config, updated_at in rows
+        ]
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # Autocommit; each statement is its own transaction. WAL lets readers and the writer overlap.
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+def build_shared_state(cfg: Dict[str, Any], worker_id: str):
+    """(pubsub, room store) for the configured backend."""
+    backend = cfg.get("backend", _DEFAULT_BACKEND)
+    if backend == "local":
+        return LocalPubSub(worker_id), LocalRoomStore()
+    if backend == "sqlite":
+        path = cfg.get("path", _DEFAULT_DB_PATH)
+        pubsub = SQLitePubSub(
+            worker_id,
+            path,
+            poll_interval_ms=cfg.get("poll_interval_ms", _DEFAULT_POLL_INTERVAL_MS),
+            retention_secs=cfg.get("retention_secs", _DEFAULT_RETENTION_SECS),
+            local_channels=() if cfg.get("share_audio", False) else (AUDIO_FRAMES_CHANNEL,),
+        )
+        return pubsub, SQLiteRoomStore(path)
+    raise ValueError(f"Unknown shared state backend: {backend}")
+
+
+def build_device_config_store(cfg: Dict[str, Any]) -> DeviceConfigStore:
+    backend = cfg.get("backend", _DEFAULT_BACKEND)
+    if backend == "local":
+        return LocalDeviceConfigStore()
+    if backend == "sqlite":
+        return SQLiteDeviceConfigStore(cfg.get("path", _DEFAULT_DB_PATH))
+    raise ValueError(f"Unknown shared state backend: {backend}")
@@ -1,8 +1,11 @@
 import json
 import uasyncio as asyncio
+from modules.clock import BackendClock
 from modules.detector import BounceDetector
 from modules.indicator import DeviceIndicator
 from modules.notifier import BackendNotifier
+from modules.remote_config import RemoteConfig
+from net import wifi_manager
 import boot
 
 def load_config():
@@ -14,20 +17,28 @@ async def main():
 
     indicator = DeviceIndicator(cfg["indicator"] | cfg["general"])
     try:
-        from net import wifi_manager
-        wifi_manager.connect()
+        wifi_manager.connect(cfg["wifi"]["connect_timeout_secs"])
     except Exception as e:
         await indicator.error()
         print("WiFi init error:", e)
 
     try:
         detector = BounceDetector(cfg["detector"] | cfg["general"])
-        notifier = BackendNotifier(cfg["notifier"] | cfg["general"], indicator=indicator)
+        clock = BackendClock(cfg["clock"] | cfg["general"])
+        notifier = BackendNotifier(cfg["notifier"] | cfg["general"], indicator=indicator, clock=clock, detector=detector)
+        remote_config = RemoteConfig(cfg["remote_config"] | cfg["general"], detector=detector)
     except Exception as e:
         await indicator.error()
         print("Couldn't initialize device components:", e)
         return
 
+    if not wifi_manager.is_connected() or not clock.sync():
+        print("Clock sync failed; events will be sent without backend timestamps")
+    asyncio.create_task(clock.run())
+    asyncio.create_task(wifi_manager.supervise(cfg["wifi"]))
+    asyncio.create_task(notifier.run())
+    asyncio.create_task(remote_config.run())
+
     await indicator.info()
 
     async for event in detector:
@@ -0,0 +1,105 @@
+import time
+
+import uasyncio as asyncio
+import urequests
+
+from net import wifi_manager
+
+
+_DEFAULT_SYNC_INTERVAL_SECS = 300
+_DEFAULT_SYNC_SAMPLES = 4
+_UNSYNCED_RETRY_SECS = 15
+_MAX_UNSYNCED_RETRY_SECS = 600
+_DRIFT_SMOOTHING = 0.5
+_MIN_DRIFT_ELAPSED_MS = 10000
+
+
+class BackendClock:
+    """
+    Maps the device's `time.ticks_ms()` onto the backend wall clock (ms since epoch).
+
+    Every sync runs a few NTP-style exchanges against the backend's clock-sync
+    endpoint and keeps the one with the smallest round trip. Between syncs the
+    estimate is extrapolated using the tracked drift of the device oscillator.
+    Backend times are kept as ints - they don't fit a single precision float.
+    """
+
+    def __init__(self, cfg):
+        self.server_url = cfg["server_url"]
+        if self.server_url.endswith("/"):
+            self.server_url = self.server_url[:-1]
+        self.sync_endpoint = f"{self.server_url}{cfg['sync_endpoint']}"
+        self.sync_interval_secs = cfg.get("sync_interval_secs", _DEFAULT_SYNC_INTERVAL_SECS)
+        self.sync_samples = cfg.get("sync_samples", _DEFAULT_SYNC_SAMPLES)
+
+        self.ref_ticks = None
+        self.ref_backend_ms = None
+        self.drift = 0.0   # Backend ms gained per device ms, on top of 1.0
+        self.rtt_ms = None
+
+    def is_synced(self):
+        return self.ref_ticks is not None
+
+    def to_backend_ms(self, ticks):
+        elapsed = time.ticks_diff(ticks, self.ref_ticks)
+        return self.ref_backend_ms + elapsed + int(elapsed * self.drift)
+
+    def now_ms(self):
+        return self.to_backend_ms(time.ticks_ms())
+
+    def _exchange(self):
+        t0 = time.ticks_ms()
+        response = urequests.post(self.sync_endpoint, json={"t0": t0}, timeout=1)
+        t3 = time.ticks_ms()
+        try:
+            if response.status_code != 200:
+                raise Exception(f"Got status code {response.status_code}: {response.text}")
+            data = response.json()
+        finally:
+            response.close()
+
+        # Round trip minus the time the backend held the request. The reply left the
+        # backend at t2, so it's about half a round trip later there when we read t3.
+        rtt = time.ticks_diff(t3, t0) - (data["t2"] - data["t1"])
+        return t3, data["t2"] + rtt // 2, rtt
+
+    def sync(self):
+        best = None
+        for _ in range(self.sync_samples):
+            try:
+                sample = self._exchange()
+            except Exception as e:
+                # Each exchange blocks up to its timeout - don't stack them against a dead backend
+                print(f"Clock sync exchange failed: {e}")
+                break
+            if best is None or sample[2] < best[2]:
+                best = sample
+
+        if best is None:
+            return False
+
+        ticks, backend_ms, rtt = best
+        if self.is_synced():
+            elapsed = time.ticks_diff(ticks, self.ref_ticks)
+            if elapsed >= _MIN_DRIFT_ELAPSED_MS:
+                drift_sample = (backend_ms - self.ref_backend_ms - elapsed) / elapsed
+                self.drift += _DRIFT_SMOOTHING * (drift_sample - self.drift)
+
+        self.ref_ticks = ticks
+        self.ref_backend_ms = backend_ms
+        self.rtt_ms = rtt
+        print(f"Clock synced: rtt={rtt}ms drift={self.drift * 1e6:.1f}ppm")
+        return True
+
+    async def run(self):
+        retry_secs = _UNSYNCED_RETRY_SECS
+        while True:
+            # Retry sooner until the first sync succeeds (e.g. booted offline), backing off
+            # while it keeps failing. sync() blocks, so it's never tried without WiFi.
+            await asyncio.sleep(self.sync_interval_secs if self.is_synced() else retry_secs)
+            if not wifi_manager.is_connected():
+                continue
+            if self.sync():
+                retry_secs = _UNSYNCED_RETRY_SECS
+            else:
+                retry_secs = min(retry_secs * 2, _MAX_UNSYNCED_RETRY_SECS)
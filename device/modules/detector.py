@@ -1,7 +1,12 @@
+import _thread
+from array import array
 import math
 import time
 
+import machine
 from machine import I2S, Pin
+import micropython
+from micropython import const
 import uasyncio as asyncio
 from ulab import numpy as np
 from ulab import scipy as scipy
@@ -9,6 +14,8 @@ import urequests
 
 from lib import wav
 from modules import events 
+from modules.identity import device_id
+from modules.ring import SPSCRing
 
 
 _SCK_PIN = 25
@@ -17,9 +24,88 @@ _SD_PIN = 32
 _DEFAULT_SAMPLE_RATE = 16000
 _INITIAL_MAX_VALUE = 50
 
+_DEFAULT_LOW_POWER_QUIET_PERIOD_SECS = 300
+_DEFAULT_LOW_POWER_WAKE_TIMEOUT_SECS = 10
+_DEFAULT_LOW_POWER_IDLE_INTERVAL_MS = 200
+_DEFAULT_LOW_POWER_IDLE_CAPTURE_MS = 20
+_DEFAULT_LOW_POWER_GATE_FACTOR = 4.0
+_IDLE_BASELINE_DECAY_FACTOR = 0.95
+_IDLE_BASELINE_FLOOR = 1.0
+_DEFAULT_ENGINE = "iir"
+
+# Settings BounceDetector.apply_config() can change between two windows. The rest size
+# buffers or the I2S peripheral and need a config.json change and a reset.
+_LIVE_CONFIG_KEYS = (
+    "bounce_threshold",
+    "rolling_max_short_decay_factor",
+    "rolling_max_long_decay_factor",
+    "highpass_filter_cutoff_freq",
+    "engine",
+    "band_low_freq",
+    "band_high_freq",
+    "band_min_ratio",
+    "debug",
+)
+
+# Fixed-point rounding bounds for BounceDetector.verify_fused_kernel(), in sample units
+_FUSED_ABS_TOLERANCE = 16
+_FUSED_REL_TOLERANCE = 0.01
+
+_DEFAULT_THREAD_STACK_SIZE = 16 * 1024
+_DEFAULT_THREAD_POLL_INTERVAL_MS = 5
+_DEFAULT_DETECTION_RING_SIZE = 16
+_DEFAULT_DEBUG_RING_SIZE = 4
+
+# Outcomes of BounceDetector._step()
+_STEP_SKIPPED = 0
+_STEP_IDLE = 1
+_STEP_WINDOW = 2
+_STEP_BOUNCE = 3
+
 _CONVERT_TO_24_BIT_WEIGHT = np.array([2**24, 2**16, 2**8])
 
 
+def _unpack_samples(u8_2d):
+    return np.array(
+        np.dot(u8_2d[:, :3], _CONVERT_TO_24_BIT_WEIGHT),
+        dtype=np.int16
+    )
+
+
+@micropython.viper
+def _unpack_samples_into(buf, n_samples: int, out):
+    """`_unpack_samples` of the raw I2S words into a preallocated int16 buffer - no allocation."""
+    src = ptr8(buf)
+    dst = ptr16(out)
+    i = 0
+    while i < n_samples:
+        j = i * 4
+        # Storing to ptr16 keeps the low 16 bits, the int16 truncation of `_unpack_samples`
+        dst[i] = (src[j] << 24) | (src[j + 1] << 16) | (src[j + 2] << 8)
+        i += 1
+
+
+class _SampleSlots:
+    """
+    Preallocated int16 sample buffers, handed out in turn. A window's samples stay valid for
+    `n` windows, so with one slot more than the debug ring holds plus the one being posted,
+    a frame waiting in the ring is never overwritten by the capture thread.
+    """
+
+    def __init__(self, window_size_samples, n):
+        self.window_size_samples = window_size_samples
+        self.bufs = [bytearray(window_size_samples * 2) for _ in range(n)]
+        self.arrays = [np.frombuffer(b, dtype=np.int16) for b in self.bufs]
+        self.next = 0
+
+    def unpack(self, buf):
+        """Unpack the I2S buffer into the next slot and return its array."""
+        i = self.next
+        self.next = (i + 1) % len(self.bufs)
+        _unpack_samples_into(buf, self.window_size_samples, self.bufs[i])
+        return self.arrays[i]
+
+
 def _butter_sos_even(N, fc_hz, fs_hz, btype='lowpass'):
     """
     Return SOS (shape [N/2, 6]) like scipy.signal.butter(..., output='sos')
@@ -101,6 +187,187 @@ def _butter_sos_even(N, fc_hz, fs_hz, btype='lowpass'):
     return sos
 
 
+# Fixed-point format of the fused kernel: feedback coefficients are Q13, and each section's
+# gain gets the most fractional bits that keep it under 2**13. With |samples| < 2**15 and a
+# few x overshoot that keeps every product sum below 2**31, the viper int width.
+_FUSED_GAIN_MAX_BITS = const(13)
+_FUSED_FEEDBACK_FRAC_BITS = const(13)
+_FUSED_FEEDBACK_ROUNDING = const(1 << (_FUSED_FEEDBACK_FRAC_BITS - 1))
+
+
+def _fixed_point_sos(sos):
+    """
+    Convert high-pass SOS coefficients to the fused kernel's int32 layout:
+    [gain, gain_shift, a1, a2] per section. A high-pass section's numerator is
+    gain * [1, -2, 1], which the kernel applies exactly in integers.
+    """
+    n_sections = sos.shape[0]
+    coeffs = array('i', [0] * (n_sections * 4))
+    for k in range(n_sections):
+        b0, b1, b2 = sos[k, 0], sos[k, 1], sos[k, 2]
+        if abs(b1 + 2 * b0) > 1e-6 * abs(b0) or abs(b2 - b0) > 1e-6 * abs(b0):
+            raise ValueError("Fused kernel needs high-pass sections with a [1, -2, 1] numerator")
+        gain_shift = 0
+        while abs(b0) * 2 ** (gain_shift + 1) <= 2 ** _FUSED_GAIN_MAX_BITS:
+            gain_shift += 1
+        coeffs[k * 4] = round(b0 * 2 ** gain_shift)
+        coeffs[k * 4 + 1] = gain_shift
+        coeffs[k * 4 + 2] = round(sos[k, 4] * 2 ** _FUSED_FEEDBACK_FRAC_BITS)
+        coeffs[k * 4 + 3] = round(sos[k, 5] * 2 ** _FUSED_FEEDBACK_FRAC_BITS)
+    return coeffs
+
+
+@micropython.viper
+def _fused_highpass_peak(buf, n_samples: int, coeffs, state, n_sections: int) -> int:
+    """
+    One pass over the raw I2S words: unpack, run the biquad cascade (direct form I,
+    zero initial state like `sosfilt` without `zi`) and return the window's peak.
+    """
+    src = ptr8(buf)
+    c = ptr32(coeffs)
+    st = ptr32(state)   # [x1, x2, y1, y2] per section
+
+    i = 0
+    while i < n_sections * 4:
+        st[i] = 0
+        i += 1
+
+    peak = 0
+    i = 0
+    while i < n_samples:
+        j = i * 4
+        # Same weights and int16 truncation as `_unpack_samples`
+        x = ((src[j] << 24) | (src[j + 1] << 16) | (src[j + 2] << 8)) & 0xFFFF
+        if x >= 0x8000:
+            x -= 0x10000
+
+        k = 0
+        while k < n_sections:
+            ci = k * 4
+            gain_shift = c[ci + 1]
+            acc_b = c[ci] * (x - 2 * st[ci] + st[ci + 1])
+            acc_a = c[ci + 2] * st[ci + 2] + c[ci + 3] * st[ci + 3]
+            y = ((acc_b + (1 << (gain_shift - 1))) >> gain_shift) - ((acc_a + _FUSED_FEEDBACK_ROUNDING) >> _FUSED_FEEDBACK_FRAC_BITS)
+            st[ci + 1] = st[ci]
+            st[ci] = x
+            st[ci + 3] = st[ci + 2]
+            st[ci + 2] = y
+            x = y
+            k += 1
+
+        if i == 0 or x > peak:
+            peak = x
+        i += 1
+    return peak
+
+
+class IIRHighpassEngine:
+    """
+    4th order Butterworth high-pass (`sosfilt`) followed by the window max.
+
+    Samples are unpacked into a preallocated buffer, but ulab's `sosfilt` has no output
+    argument and returns a new array per window (the debug samples). `iir_fused` is the
+    allocation-free variant.
+    """
+
+    def __init__(self, cfg, sample_rate, buf, n_slots=1):
+        self.buf = buf
+        self.unpacked = _SampleSlots(len(buf) // 4, 1)  # Only read by `sosfilt`, never handed out
+        self.highpass_filter_cutoff_freq = cfg["highpass_filter_cutoff_freq"]
+        self.highpass_filter_sos = _butter_sos_even(4, self.highpass_filter_cutoff_freq, sample_rate, btype='highpass')
+        self.samples = None
+
+    def process(self):
+        self.samples = scipy.signal.sosfilt(self.highpass_filter_sos, self.unpacked.unpack(self.buf))
+        return np.max(self.samples)
+
+
+class BandEnergyEngine:
+    """
+    RMS amplitude of the window's energy in the bounce's band [band_low_freq, band_high_freq],
+    computed with ulab's FFT on a Hann-tapered, zero padded window.
+
+    Broadband transients (claps, door slams) also put energy in the band, so windows whose
+    band-to-total energy ratio is below `band_min_ratio` are attenuated proportionally.
+
+    The window's samples (handed out for debug) rotate through `n_slots` preallocated buffers
+    and the taper is applied in place; ulab's FFT still returns new arrays.
+    """
+
+    def __init__(self, cfg, sample_rate, buf, n_slots=1):
+        window_size_samples = len(buf) // 4
+        self.buf = buf
+        self.slots = _SampleSlots(window_size_samples, n_slots)
+        self.window_size_samples = window_size_samples
+
+        # ulab's FFT only takes power-of-two lengths
+        self.nfft = 1
+        while self.nfft < window_size_samples:
+            self.nfft *= 2
+        self.fft_buf = np.zeros(self.nfft)
+        self.fft_window = self.fft_buf[:window_size_samples]  # View, the zero padding stays
+        self.taper = np.array([0.5 - 0.5 * math.cos(2 * math.pi * i / (window_size_samples - 1)) for i in range(window_size_samples)])
+        # Parseval: both spectrum halves, FFT length and taper energy
+        self.scale = 2.0 / (self.nfft * np.sum(self.taper * self.taper))
+
+        band_low_freq = cfg.get("band_low_freq", cfg["highpass_filter_cutoff_freq"])
+        band_high_freq = cfg.get("band_high_freq", sample_rate / 2)
+        self.half_spectrum = self.nfft // 2 + 1
+        self.band_low_bin = max(1, int(band_low_freq * self.nfft / sample_rate))
+        self.band_high_bin = min(self.half_spectrum, int(band_high_freq * self.nfft / sample_rate) + 1)
+        self.band_min_ratio = cfg.get("band_min_ratio", 0)
+        self.samples = None
+
+    def process(self):
+        self.samples = self.slots.unpack(self.buf)
+        self.fft_window[:] = self.samples
+        self.fft_window *= self.taper
+        spectrum = np.fft.fft(self.fft_buf)
+        if isinstance(spectrum, tuple):     # ulab built without complex support
+            re, im = spectrum
+        else:
+            re, im = np.real(spectrum), np.imag(spectrum)
+        re = re[:self.half_spectrum]
+        im = im[:self.half_spectrum]
+        power = re * re + im * im
+
+        band_energy = np.sum(power[self.band_low_bin:self.band_high_bin])
+        value = math.sqrt(self.scale * band_energy)
+        if self.band_min_ratio > 0:
+            total_energy = np.sum(power[1:])
+            ratio = band_energy / total_energy if total_energy > 0 else 0
+            if ratio < self.band_min_ratio:
+                value *= ratio / self.band_min_ratio
+        return value
+
+
+class FusedIIRHighpassEngine:
+    """
+    Same high-pass + window max as IIRHighpassEngine, as a single viper pass over the raw
+    I2S buffer in fixed-point. No intermediate arrays, so there are no filtered samples
+    to send in debug mode.
+    """
+
+    def __init__(self, cfg, sample_rate, buf, n_slots=1):
+        self.buf = buf
+        self.window_size_samples = len(buf) // 4
+        self.highpass_filter_cutoff_freq = cfg["highpass_filter_cutoff_freq"]
+        sos = _butter_sos_even(4, self.highpass_filter_cutoff_freq, sample_rate, btype='highpass')
+        self.n_sections = sos.shape[0]
+        self.coeffs = _fixed_point_sos(sos)
+        self.state = array('i', [0] * (self.n_sections * 4))
+        self.samples = None
+
+    def process(self):
+        return _fused_highpass_peak(self.buf, self.window_size_samples, self.coeffs, self.state, self.n_sections)
+
+
+_ENGINES = {
+    "iir": IIRHighpassEngine,
+    "iir_fused": FusedIIRHighpassEngine,
+    "band": BandEnergyEngine,
+}
+
 
 class BounceDetector:
 
@@ -122,7 +389,6 @@ class BounceDetector:
             ibuf=min(4096, self.window_size_samples * 4),
         )
         self.buf = bytearray(self.window_size_samples * 4)
-        self.u8_2d = np.frombuffer(self.buf, dtype=np.uint8).reshape((self.window_size_samples, 4))   # [sample, byte]
 
         self.rolling_max_short = _INITIAL_MAX_VALUE
         self.rolling_max_long = _INITIAL_MAX_VALUE
@@ -130,12 +396,65 @@ class BounceDetector:
         self.rolling_max_long_decay_factor = cfg["rolling_max_long_decay_factor"]
         self.bounce_threshold = cfg["bounce_threshold"]
 
-        self.highpass_filter_cutoff_freq = cfg["highpass_filter_cutoff_freq"]
-        self.highpass_filter_sos = _butter_sos_even(4, self.highpass_filter_cutoff_freq, self.sample_rate, btype='highpass')
-        self.prev_highpass_filter_output = 0
-        self.prev_highpass_filter_input = 0
+        # Threaded mode: capture + DSP run on their own thread so they never wait on the
+        # network or the LED. Only the capture thread touches the I2S buffers. A window's
+        # debug samples may wait in the ring while later windows are processed, so engines
+        # rotate them through enough preallocated slots.
+        self.threaded = cfg.get("threaded", False)
+        self.debug_ring_size = cfg.get("debug_ring_size", _DEFAULT_DEBUG_RING_SIZE)
+        self.sample_slots = self.debug_ring_size + 2 if self.threaded else 1  # + the one posted and the one written
+
+        self.cfg = cfg
+        self.engine_name = cfg.get("engine", _DEFAULT_ENGINE)
+        if self.engine_name not in _ENGINES:
+            raise ValueError(f"Unknown detector engine: {self.engine_name}")
+        self.engine = _ENGINES[self.engine_name](cfg, self.sample_rate, self.buf, self.sample_slots)
+
+        # Overrides pushed from the backend (see apply_config) apply on top of the file's config
+        self.base_cfg = cfg
+        self.config_version = 0
+        self.pending_config = None
+        self.config_lock = _thread.allocate_lock()
 
         self.bounce_ctr = 0 
+        self.window_ticks = 0
+        self.samples = None
+
+        # Low power mode: after a quiet period, only run a cheap energy gate on short
+        # captures spaced `low_power_idle_interval_ms` apart. Worst case wake-up latency
+        # is one interval plus the I2S DMA backlog (`ibuf`) plus the idle capture.
+        self.low_power = cfg.get("low_power_enabled", False)
+        self.low_power_quiet_period_ms = int(cfg.get("low_power_quiet_period_secs", _DEFAULT_LOW_POWER_QUIET_PERIOD_SECS) * 1000)
+        self.low_power_wake_timeout_ms = int(cfg.get("low_power_wake_timeout_secs", _DEFAULT_LOW_POWER_WAKE_TIMEOUT_SECS) * 1000)
+        self.low_power_idle_interval_ms = cfg.get("low_power_idle_interval_ms", _DEFAULT_LOW_POWER_IDLE_INTERVAL_MS)
+        self.low_power_gate_factor = cfg.get("low_power_gate_factor", _DEFAULT_LOW_POWER_GATE_FACTOR)
+        self.low_power_light_sleep = cfg.get("low_power_light_sleep", False)
+        idle_capture_samples = int(cfg.get("low_power_idle_capture_ms", _DEFAULT_LOW_POWER_IDLE_CAPTURE_MS) * self.sample_rate / 1000)
+        self.idle_buf = bytearray(idle_capture_samples * 4)
+        self.idle_u8_2d = np.frombuffer(self.idle_buf, dtype=np.uint8).reshape((idle_capture_samples, 4))
+        self.idle_baseline = None
+        self.is_idle = False
+        self.is_wake_confirmed = True
+        self.last_activity_ticks = time.ticks_ms()
+        self.mode_change_ticks = self.last_activity_ticks
+        self.stats = {
+            "windows": 0,
+            "window_us": 0,
+            "idle_checks": 0,
+            "idle_check_us": 0,
+            "idle_ms": 0,
+            "wakeups": 0,
+            "confirmed_wakeups": 0,
+            "wake_to_bounce_ms": 0,
+            "dropped_detections": 0,
+            "dropped_debug_frames": 0,
+        }
+
+        self.thread_stack_size = cfg.get("thread_stack_size", _DEFAULT_THREAD_STACK_SIZE)
+        self.thread_poll_interval_ms = cfg.get("thread_poll_interval_ms", _DEFAULT_THREAD_POLL_INTERVAL_MS)
+        self.detections = SPSCRing(cfg.get("detection_ring_size", _DEFAULT_DETECTION_RING_SIZE))
+        self.debug_frames = SPSCRing(self.debug_ring_size)
+        self.running = False
 
         self.server_url = cfg["server_url"]
         if self.server_url.endswith("/"):
@@ -144,48 +463,267 @@ class BounceDetector:
 
 
     def __aiter__(self):
+        if self.threaded and not self.running:
+            self.start_thread()
         # Return the iterator object itself
         return self
 
     async def __anext__(self):
+        if self.threaded:
+            return await self._next_from_thread()
 
         while True:
-            n = self.i2s.readinto(self.buf)
-            if n != len(self.buf):
-                print(f"Expected {len(self.buf)} samples, got {n}")
+            step = self._step()
+            if step == _STEP_IDLE:
+                await self._idle_sleep()
                 continue
-            elif n <= 0:
-                print("No samples read")
+            elif step == _STEP_SKIPPED:
                 continue
 
-            samples = np.array(
-                np.dot(self.u8_2d[:, :3], _CONVERT_TO_24_BIT_WEIGHT),
-                dtype=np.int16
-            )
-            samples = scipy.signal.sosfilt(self.highpass_filter_sos, samples)
-            window_max_value = np.max(samples)  
-            self.rolling_max_short = self.rolling_max_short_decay_factor * self.rolling_max_short + (1 - self.rolling_max_short_decay_factor) * window_max_value
-            self.rolling_max_long = self.rolling_max_long_decay_factor * self.rolling_max_long + (1 - self.rolling_max_long_decay_factor) * window_max_value
-            signal = (window_max_value - self.rolling_max_short) / self.rolling_max_long
-            is_bounce = signal > self.bounce_threshold
-
+            is_bounce = step == _STEP_BOUNCE
             if self.debug:
-                await self._send_debug_samples_to_backend(samples, is_bounce)
+                await self._send_debug_samples_to_backend(self.samples, is_bounce)
 
             if is_bounce:
-                self.bounce_ctr += 1
-                return events.BounceDetectedEvent(bounce_ctr=self.bounce_ctr)
+                return events.BounceDetectedEvent(bounce_ctr=self.bounce_ctr, timestamp=self.window_ticks,
+                                                  config_version=self.config_version)
+
+            # Let background tasks (e.g. clock sync) run between windows
+            await asyncio.sleep_ms(0)
+
+    def _step(self):
+        """One capture + DSP step (or one idle check in low power mode). Blocks on the I2S read."""
+        if self.pending_config is not None:
+            self._apply_pending_config()
+
+        if self.is_idle:
+            if self._idle_check():
+                self._wake()
+                return _STEP_SKIPPED
+            return _STEP_IDLE
+
+        n = self.i2s.readinto(self.buf)
+        self.window_ticks = time.ticks_ms()
+        if n != len(self.buf):
+            print(f"Expected {len(self.buf)} samples, got {n}")
+            return _STEP_SKIPPED
+        elif n <= 0:
+            print("No samples read")
+            return _STEP_SKIPPED
+
+        if self._process_window():
+            self.bounce_ctr += 1
+            self._on_bounce()
+            return _STEP_BOUNCE
+
+        if self.low_power:
+            self._check_quiet_period()
+        return _STEP_WINDOW
+
+    def start_thread(self):
+        """Move capture and DSP to their own thread; detections reach the event loop through a ring."""
+        self.running = True
+        _thread.stack_size(self.thread_stack_size)
+        _thread.start_new_thread(self._capture_loop, ())
+
+    def stop_thread(self):
+        self.running = False
+
+    def _capture_loop(self):
+        while self.running:
+            step = self._step()
+            if step == _STEP_IDLE:
+                self._idle_sleep_blocking()
+                continue
+            elif step == _STEP_SKIPPED:
+                continue
 
+            is_bounce = step == _STEP_BOUNCE
+            # Samples stay valid until their slot comes round again, after the ring's capacity
+            if self.debug and self.samples is not None and not self.debug_frames.push((self.samples, is_bounce, self.bounce_ctr)):
+                self.stats["dropped_debug_frames"] += 1
 
+            if is_bounce and not self.detections.push((self.bounce_ctr, self.window_ticks, self.config_version)):
+                self.stats["dropped_detections"] += 1
 
-    async def _send_debug_samples_to_backend(self, samples, is_bounce):
+    async def _next_from_thread(self):
+        while True:
+            if self.debug:
+                frame = self.debug_frames.pop()
+                while frame is not None:
+                    samples, is_bounce, bounce_ctr = frame
+                    await self._send_debug_samples_to_backend(samples, is_bounce, bounce_ctr)
+                    frame = self.debug_frames.pop()
+
+            detection = self.detections.pop()
+            if detection is not None:
+                bounce_ctr, window_ticks, config_version = detection
+                return events.BounceDetectedEvent(bounce_ctr=bounce_ctr, timestamp=window_ticks, config_version=config_version)
+
+            await asyncio.sleep_ms(self.thread_poll_interval_ms)
+
+    def apply_config(self, overrides, version):
+        """
+        Stage detector overrides (e.g. pushed from the backend) to take effect before the next
+        window. Everything that can fail or allocate - validation, the new engine and its SOS
+        coefficients - happens here, so the swap between windows is just a few assignments.
+        The I2S peripheral, its buffers and the rolling maxima are kept.
+
+        `overrides` replace the previous ones; keys left out fall back to config.json.
+        """
+        for key in overrides:
+            if key not in _LIVE_CONFIG_KEYS:
+                raise ValueError(f"'{key}' can't be changed live")
+        cfg = dict(self.base_cfg)
+        cfg.update(overrides)
+        engine_name = cfg.get("engine", _DEFAULT_ENGINE)
+        if engine_name not in _ENGINES:
+            raise ValueError(f"Unknown detector engine: {engine_name}")
+        if not 0 < cfg["highpass_filter_cutoff_freq"] < self.sample_rate / 2:
+            raise ValueError(f"Cutoff must be below Nyquist ({self.sample_rate // 2}Hz)")
+        if engine_name == "band" and not (cfg.get("band_low_freq", cfg["highpass_filter_cutoff_freq"])
+                                          < cfg.get("band_high_freq", self.sample_rate / 2)):
+            raise ValueError("Band low frequency must be below the high one")
+        # Engines only create views on self.buf - safe while the capture thread reads into it
+        engine = _ENGINES[engine_name](cfg, self.sample_rate, self.buf, self.sample_slots)
+
+        with self.config_lock:
+            self.pending_config = (cfg, engine_name, engine, version)
+
+    def _apply_pending_config(self):
+        with self.config_lock:
+            cfg, engine_name, engine, version = self.pending_config
+            self.pending_config = None
+
+        self.cfg = cfg
+        self.engine_name = engine_name
+        self.engine = engine
+        self.rolling_max_short_decay_factor = cfg["rolling_max_short_decay_factor"]
+        self.rolling_max_long_decay_factor = cfg["rolling_max_long_decay_factor"]
+        self.bounce_threshold = cfg["bounce_threshold"]
+        self.debug = cfg.get("debug", False)
+        self.config_version = version
+        print(f"Detector config version {version} applied (engine {engine_name})")
+
+    def _process_window(self):
+        start_us = time.ticks_us()
+        window_max_value = self.engine.process()
+        self.rolling_max_short = self.rolling_max_short_decay_factor * self.rolling_max_short + (1 - self.rolling_max_short_decay_factor) * window_max_value
+        self.rolling_max_long = self.rolling_max_long_decay_factor * self.rolling_max_long + (1 - self.rolling_max_long_decay_factor) * window_max_value
+        signal = (window_max_value - self.rolling_max_short) / self.rolling_max_long
+        self.samples = self.engine.samples
+        self.stats["windows"] += 1
+        self.stats["window_us"] += time.ticks_diff(time.ticks_us(), start_us)
+        return signal > self.bounce_threshold
+
+    def _on_bounce(self):
+        self.last_activity_ticks = self.window_ticks
+        if not self.is_wake_confirmed:
+            self.is_wake_confirmed = True
+            self.stats["confirmed_wakeups"] += 1
+            self.stats["wake_to_bounce_ms"] += time.ticks_diff(self.window_ticks, self.mode_change_ticks)
+
+    def _check_quiet_period(self):
+        # An unconfirmed wake-up (door slam, clap) falls back to idle much sooner
+        timeout_ms = self.low_power_quiet_period_ms if self.is_wake_confirmed else self.low_power_wake_timeout_ms
+        if time.ticks_diff(self.window_ticks, self.last_activity_ticks) >= timeout_ms:
+            self._enter_idle()
+
+    def _enter_idle(self):
+        self.is_idle = True
+        self.idle_baseline = None
+        self.mode_change_ticks = time.ticks_ms()
+        print(f"Entering low power mode. Stats: {self.stats}")
+
+    def _wake(self):
+        now = time.ticks_ms()
+        self.is_idle = False
+        self.is_wake_confirmed = False
+        self.stats["wakeups"] += 1
+        self.stats["idle_ms"] += time.ticks_diff(now, self.mode_change_ticks)
+        self.mode_change_ticks = now
+        self.last_activity_ticks = now
+        print("Candidate transient - back to full rate detection")
+
+    def _idle_check(self):
+        """Cheap energy gate: peak first difference of a short capture against its running baseline"""
+        n = self.i2s.readinto(self.idle_buf)
+        if n != len(self.idle_buf):
+            return False
+
+        start_us = time.ticks_us()
+        # The first difference stands in for the high-pass filter - it's mostly high frequency energy
+        samples = np.array(_unpack_samples(self.idle_u8_2d), dtype=np.float)
+        peak = np.max(np.abs(samples[1:] - samples[:-1]))
+        if self.idle_baseline is None:
+            self.idle_baseline = max(peak, _IDLE_BASELINE_FLOOR)
+        is_candidate = peak > self.low_power_gate_factor * self.idle_baseline
+        if not is_candidate:
+            self.idle_baseline = _IDLE_BASELINE_DECAY_FACTOR * self.idle_baseline + (1 - _IDLE_BASELINE_DECAY_FACTOR) * peak
+        self.stats["idle_checks"] += 1
+        self.stats["idle_check_us"] += time.ticks_diff(time.ticks_us(), start_us)
+        return is_candidate
+
+    async def _idle_sleep(self):
+        if self.low_power_light_sleep:
+            # Suspends the whole loop (and the I2S clock) - verify Wi-Fi survives on your board
+            machine.lightsleep(self.low_power_idle_interval_ms)
+        else:
+            await asyncio.sleep_ms(self.low_power_idle_interval_ms)
+
+    def _idle_sleep_blocking(self):
+        if self.low_power_light_sleep:
+            machine.lightsleep(self.low_power_idle_interval_ms)
+        else:
+            time.sleep_ms(self.low_power_idle_interval_ms)
+
+    def benchmark_engines(self, n_windows=50):
+        """Time every engine on the same captured window. Run from the REPL, not while the capture thread runs."""
+        self.i2s.readinto(self.buf)
+        results = {}
+        for name, engine_cls in _ENGINES.items():
+            engine = engine_cls(self.cfg, self.sample_rate, self.buf)
+            engine.process()    # Warm up (first call allocates)
+            start_us = time.ticks_us()
+            for _ in range(n_windows):
+                engine.process()
+            results[name] = time.ticks_diff(time.ticks_us(), start_us) // n_windows
+        budget_us = self.window_size_ms * 1000
+        for name, per_window_us in results.items():
+            print(f"{name}: {per_window_us}us per window ({100 * per_window_us / budget_us:.1f}% of the {self.window_size_ms}ms budget)")
+        return results
+
+    def verify_fused_kernel(self, n_windows=20):
+        """Check the fused kernel against the ulab path on live windows. Run from the REPL, not while the capture thread runs."""
+        reference = IIRHighpassEngine(self.cfg, self.sample_rate, self.buf)
+        fused = FusedIIRHighpassEngine(self.cfg, self.sample_rate, self.buf)
+        worst_diff = 0
+        ok = True
+        for _ in range(n_windows):
+            self.i2s.readinto(self.buf)
+            expected = reference.process()
+            actual = fused.process()
+            diff = abs(actual - expected)
+            worst_diff = max(worst_diff, diff)
+            if diff > _FUSED_ABS_TOLERANCE + _FUSED_REL_TOLERANCE * abs(expected):
+                ok = False
+                print(f"Mismatch: ulab={expected} fused={actual}")
+        print(f"Fused kernel {'matches' if ok else 'does NOT match'} the ulab path (worst abs diff {worst_diff})")
+        return ok
+
+    async def _send_debug_samples_to_backend(self, samples, is_bounce, bounce_ctr=None):
         """Send samples to the backend via HTTP POST"""
-        payload = events.DebugSamplesEvent(samples, is_bounce, self.bounce_ctr, self.sample_rate)
+        if samples is None:
+            # Engine has no per-sample output (e.g. the fused kernel)
+            return
+        if bounce_ctr is None:
+            bounce_ctr = self.bounce_ctr
+        payload = events.DebugSamplesEvent(samples, is_bounce, bounce_ctr, self.sample_rate)
         try:
             response = urequests.post(
                 self.debug_audio_samples_endpoint,
                 json=payload.to_dict(),
-                headers={"Content-Type": "application/json"}
+                headers={"Content-Type": "application/json", "X-Device-Id": device_id()}
             )
             
             if response.status_code != 200:
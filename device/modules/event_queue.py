@@ -0,0 +1,82 @@
+import json
+import os
+
+
+_DEFAULT_MAX_RAM_EVENTS = 32
+_DEFAULT_MAX_SPILL_EVENTS = 2000
+_DEFAULT_SPILL_PATH = "events.spill"
+
+
+class EventQueue:
+    """
+    Bounded FIFO of event dicts waiting to be delivered to the backend.
+
+    The oldest events live in RAM. Once RAM is full, newer events are appended to a
+    JSON-lines file on flash (and keep going there while it's non-empty, to preserve
+    order). When RAM drains, the next batch is loaded back from flash. Spilled events
+    survive a reboot. Beyond `max_spill_events` new events are dropped and counted.
+    """
+
+    def __init__(self, cfg):
+        self.max_ram_events = cfg.get("queue_max_ram_events", _DEFAULT_MAX_RAM_EVENTS)
+        self.max_spill_events = cfg.get("queue_max_spill_events", _DEFAULT_MAX_SPILL_EVENTS)
+        self.spill_path = cfg.get("queue_spill_path", _DEFAULT_SPILL_PATH)
+
+        self.ram = []
+        self.spilled = self._count_spilled()
+        self.dropped = 0
+        if self.spilled:
+            print(f"Found {self.spilled} undelivered events on flash")
+
+    def __len__(self):
+        return len(self.ram) + self.spilled
+
+    def push(self, event):
+        if self.spilled == 0 and len(self.ram) < self.max_ram_events:
+            self.ram.append(event)
+            return True
+
+        if self.spilled >= self.max_spill_events:
+            self.dropped += 1
+            return False
+
+        with open(self.spill_path, "a") as f:
+            f.write(json.dumps(event))
+            f.write("\n")
+        self.spilled += 1
+        return True
+
+    def peek(self, n):
+        """The oldest `n` events (or fewer). They stay queued until `commit()`."""
+        if not self.ram and self.spilled:
+            self._refill_from_flash()
+        return self.ram[:n]
+
+    def commit(self, n):
+        """Drop the oldest `n` events after they were delivered."""
+        del self.ram[:n]
+
+    def _count_spilled(self):
+        try:
+            with open(self.spill_path) as f:
+                return sum(1 for _ in f)
+        except OSError:
+            return 0
+
+    def _refill_from_flash(self):
+        # Load the head of the spill file into RAM and rewrite the remainder
+        tmp_path = self.spill_path + ".tmp"
+        remaining = 0
+        with open(self.spill_path) as src, open(tmp_path, "w") as dst:
+            for line in src:
+                if len(self.ram) < self.max_ram_events:
+                    self.ram.append(json.loads(line))
+                else:
+                    dst.write(line)
+                    remaining += 1
+        os.remove(self.spill_path)
+        if remaining:
+            os.rename(tmp_path, self.spill_path)
+        else:
+            os.remove(tmp_path)
+        self.spilled = remaining
@@ -3,15 +3,17 @@ from ulab import numpy as np
 
 
 class BounceDetectedEvent:
-    def __init__(self, bounce_ctr):
-        self.timestamp = time.ticks_ms()
+    def __init__(self, bounce_ctr, timestamp=None, config_version=0):
+        self.timestamp = time.ticks_ms() if timestamp is None else timestamp
         self.bounce_ctr = bounce_ctr
+        self.config_version = config_version
     
     def to_dict(self):
         return {
             "type": "bounce-detected",
             "timestamp": self.timestamp,
-            "bounce_ctr": self.bounce_ctr
+            "bounce_ctr": self.bounce_ctr,
+            "config_version": self.config_version
         }
 
 class DebugSamplesEvent:
@@ -0,0 +1,24 @@
+import os
+
+import machine
+import ubinascii
+
+
+_device_id = None
+_boot_id = None
+
+
+def device_id():
+    """Hex of the chip's unique id (its factory MAC on the ESP32) - survives reflashing and config changes."""
+    global _device_id
+    if _device_id is None:
+        _device_id = ubinascii.hexlify(machine.unique_id()).decode()
+    return _device_id
+
+
+def boot_id():
+    """Random per boot - bounce counters restart at every boot, while queued events survive it."""
+    global _boot_id
+    if _boot_id is None:
+        _boot_id = ubinascii.hexlify(os.urandom(4)).decode()
+    return _boot_id
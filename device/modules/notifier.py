@@ -1,41 +1,131 @@
+import time
 import uasyncio as asyncio
 import urequests
 import requests
 
+from modules.event_queue import EventQueue
+from modules.identity import boot_id, device_id
+from net import wifi_manager
+
+
+_DEFAULT_BATCH_SIZE = 16
+_DEFAULT_DRAIN_INTERVAL_MS = 500
+_DEFAULT_MAX_BACKOFF_MS = 30000
+_DEFAULT_RETRY_QUIET_MS = 5000
+
 
 class BackendNotifier:
 
-    def __init__(self, cfg, indicator):
+    def __init__(self, cfg, indicator, clock=None, detector=None):
         self.server_url = cfg["server_url"]
         if self.server_url.endswith("/"):
             self.server_url = self.server_url[:-1]
 
-        self.event_endpoint = f"{self.server_url}{cfg["pingpong_event_endpoint"]}"
+        self.events_endpoint = f"{self.server_url}{cfg["pingpong_events_endpoint"]}"
         self.ping_endpoint = f"{self.server_url}{cfg["ping_endpoint"]}"
 
+        self.room = cfg.get("room")
+
         self.indicator = indicator
+        self.clock = clock
+        self.detector = detector
+
+        self.queue = EventQueue(cfg)
+        self.rejected = False  # Whether the backend refused the last batch as malformed
+        self.batch_size = cfg.get("batch_size", _DEFAULT_BATCH_SIZE)
+        self.drain_interval_ms = cfg.get("drain_interval_ms", _DEFAULT_DRAIN_INTERVAL_MS)
+        self.max_backoff_ms = cfg.get("max_backoff_ms", _DEFAULT_MAX_BACKOFF_MS)
+        self.retry_quiet_ms = cfg.get("retry_quiet_ms", _DEFAULT_RETRY_QUIET_MS)
 
         self._test_endpoint()
 
 
     def _test_endpoint(self):
+        # Not fatal: events are queued until the backend is reachable
         try:
             response = requests.get(self.ping_endpoint, timeout=1)
             if response.status_code != 200:
                 raise Exception(f"Error testing endpoint: Got status code {response.status_code}: {response.text}")
+            return True
 
         except Exception as e:
-            print(f"Error testing endpoint: {e}")
-            raise RuntimeError("Failed to reach backend endpoints") from e
+            print(f"Error testing endpoint: {e}. Events will be queued until the backend is reachable.")
+            return False
 
 
     async def send_event(self, event):
+        """Queue an event for delivery. Never touches the network, so detection isn't held up."""
+        data = event.to_dict()
+        data["device_id"] = device_id()
+        # Lets the backend ignore events of a batch it handled but couldn't ack (e.g. timeout)
+        data["event_id"] = f"{device_id()}-{boot_id()}-{event.bounce_ctr}"
+        if self.room is not None:
+            data["room"] = self.room
+        if self.clock is not None and self.clock.is_synced():
+            data["captured_at_ms"] = self.clock.to_backend_ms(event.timestamp)
+        if not self.queue.push(data):
+            print(f"Event queue full, dropped event ({self.queue.dropped} so far)")
+
+
+    async def run(self):
+        """Drain the queue in batches whenever WiFi is up, backing off while the backend fails."""
+        backoff_ms = self.drain_interval_ms
+        while True:
+            if len(self.queue) == 0 or not wifi_manager.is_connected():
+                await asyncio.sleep_ms(self.drain_interval_ms)
+                continue
+            if backoff_ms > self.drain_interval_ms and self._retry_would_stall_detection():
+                await asyncio.sleep_ms(self.drain_interval_ms)
+                continue
+
+            batch = self.queue.peek(self.batch_size)
+            if self._post_batch(batch):
+                self.queue.commit(len(batch))
+                backoff_ms = self.drain_interval_ms
+                continue
+            if self.rejected:
+                # Malformed - resending won't help, and it would block the events behind it
+                print(f"Backend rejected a batch of {len(batch)} events, dropping it")
+                self.queue.commit(len(batch))
+                backoff_ms = self.drain_interval_ms
+                continue
+
+            # Only signal the first failure of a streak
+            if backoff_ms == self.drain_interval_ms:
+                await self.indicator.error()
+            await asyncio.sleep_ms(backoff_ms)
+            backoff_ms = min(backoff_ms * 2, self.max_backoff_ms)
+
+
+    def _retry_would_stall_detection(self):
+        """
+        Without the capture thread, a post blocks I2S reads for up to its timeout - far longer
+        than the DMA buffer - and a backend that just failed is likely to time out again. So
+        retries wait until no bounce was detected for `retry_quiet_ms`; with `threaded: true`
+        they don't need to.
+        """
+        if self.detector is None or self.detector.threaded:
+            return False
+        return time.ticks_diff(time.ticks_ms(), self.detector.last_activity_ticks) < self.retry_quiet_ms
+
+
+    def _post_batch(self, batch):
+        self.rejected = False
         try:
-            data = event.to_dict()
-            response = urequests.post(self.event_endpoint, json=data, timeout=1)
-            if response.status_code != 200:
-                raise Exception(f"Error sending event to backend: Got status code {response.status_code}: {response.text}")
+            if self.clock is not None and self.clock.is_synced():
+                sent_at_ms = self.clock.now_ms()
+                for data in batch:
+                    data["sent_at_ms"] = sent_at_ms
+            response = urequests.post(self.events_endpoint, json={"events": batch},
+                                      headers={"X-Device-Id": device_id()}, timeout=1)
+            try:
+                self.rejected = response.status_code == 400
+                if response.status_code != 200:
+                    raise Exception(f"Got status code {response.status_code}: {response.text}")
+            finally:
+                response.close()
+            return True
 
         except Exception as e:
-            await self.indicator.error()
-            print(f"Error sending event to backend: {e}")
\ No newline at end of file
+            print(f"Error sending {len(batch)} events to backend ({len(self.queue)} queued): {e}")
+            return False
@@ -0,0 +1,57 @@
+import uasyncio as asyncio
+import urequests
+
+from modules.identity import device_id
+from net import wifi_manager
+
+
+_DEFAULT_POLL_INTERVAL_SECS = 30
+
+
+class RemoteConfig:
+    """
+    Polls the backend for this device's detector overrides and hands new versions to the detector.
+
+    The backend answers 304 while the version we applied is current, so a poll costs one small
+    request. A config the detector rejects is still recorded as seen - it's not retried until
+    the backend publishes a newer version.
+    """
+
+    def __init__(self, cfg, detector):
+        self.server_url = cfg["server_url"]
+        if self.server_url.endswith("/"):
+            self.server_url = self.server_url[:-1]
+        self.config_endpoint = f"{self.server_url}{cfg['detector_config_endpoint']}/{device_id()}"
+        self.poll_interval_secs = cfg.get("poll_interval_secs", _DEFAULT_POLL_INTERVAL_SECS)
+
+        self.detector = detector
+        self.version = 0
+
+    def poll(self):
+        response = urequests.get(f"{self.config_endpoint}?version={self.version}", timeout=1)
+        try:
+            if response.status_code == 304:
+                return False
+            if response.status_code != 200:
+                raise Exception(f"Got status code {response.status_code}: {response.text}")
+            data = response.json()
+        finally:
+            response.close()
+
+        if data["version"] == self.version:
+            return False
+        try:
+            self.detector.apply_config(data["config"], data["version"])
+        except ValueError as e:
+            print(f"Rejected detector config version {data['version']}: {e}")
+        self.version = data["version"]
+        return True
+
+    async def run(self):
+        while True:
+            if wifi_manager.is_connected():
+                try:
+                    self.poll()
+                except Exception as e:
+                    print(f"Detector config poll failed: {e}")
+            await asyncio.sleep(self.poll_interval_secs)
@@ -0,0 +1,33 @@
+class SPSCRing:
+    """
+    Fixed-size single-producer/single-consumer ring buffer.
+
+    The producer only ever advances `head` and the consumer only ever advances `tail`,
+    and each is a single attribute store, so the two sides never need a lock. One slot
+    is kept empty to tell a full ring from an empty one. Pushing to a full ring drops
+    the item and returns False - the producer must never block.
+    """
+
+    def __init__(self, capacity):
+        self.slots = [None] * (capacity + 1)
+        self.head = 0
+        self.tail = 0
+
+    def push(self, item):
+        next_head = (self.head + 1) % len(self.slots)
+        if next_head == self.tail:
+            return False
+        self.slots[self.head] = item
+        self.head = next_head
+        return True
+
+    def pop(self):
+        if self.tail == self.head:
+            return None
+        item = self.slots[self.tail]
+        self.slots[self.tail] = None
+        self.tail = (self.tail + 1) % len(self.slots)
+        return item
+
+    def __len__(self):
+        return (self.head - self.tail) % len(self.slots)
@@ -1,4 +1,10 @@
 import json, network, time
+import uasyncio as asyncio
+
+_DEFAULT_CONNECT_TIMEOUT_S = 15
+_DEFAULT_CHECK_INTERVAL_MS = 2000
+_DEFAULT_MIN_BACKOFF_MS = 1000
+_DEFAULT_MAX_BACKOFF_MS = 60000
 
 def load_secrets():
     try:
@@ -7,10 +13,15 @@ def load_secrets():
     except OSError:
         return {}
 
-def connect(timeout_s=15):
-    secrets = load_secrets()
-    cred = secrets.get("wifi", {})
-    ssid, pwd = cred.get("ssid"), cred.get("password")
+def _credentials():
+    cred = load_secrets().get("wifi", {})
+    return cred.get("ssid"), cred.get("password")
+
+def is_connected():
+    return network.WLAN(network.STA_IF).isconnected()
+
+def connect(timeout_s=_DEFAULT_CONNECT_TIMEOUT_S):
+    ssid, pwd = _credentials()
 
     sta = network.WLAN(network.STA_IF)
 
@@ -24,12 +35,57 @@ def connect(timeout_s=15):
     if not sta.isconnected():
         print(f"Connecting to {ssid}...")
         sta.connect(ssid, pwd)
+        deadline = time.ticks_add(time.ticks_ms(), int(timeout_s * 1000))
         while not sta.isconnected():
+            if time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+                print(f"WiFi connect timed out after {timeout_s}s")
+                return None
             time.sleep_ms(200)
     print(f"Connected: {sta.ifconfig()=}")
 
     return sta
 
+async def supervise(cfg):
+    """Keep the station connected, reconnecting with exponential backoff. Never blocks the loop."""
+    ssid, pwd = _credentials()
+    if not ssid:
+        print("No WiFi credentials found; WiFi supervisor not running.")
+        return
+
+    connect_timeout_ms = int(cfg.get("connect_timeout_secs", _DEFAULT_CONNECT_TIMEOUT_S) * 1000)
+    check_interval_ms = cfg.get("check_interval_ms", _DEFAULT_CHECK_INTERVAL_MS)
+    min_backoff_ms = cfg.get("min_backoff_ms", _DEFAULT_MIN_BACKOFF_MS)
+    max_backoff_ms = cfg.get("max_backoff_ms", _DEFAULT_MAX_BACKOFF_MS)
+
+    sta = network.WLAN(network.STA_IF)
+    backoff_ms = min_backoff_ms
+    while True:
+        if sta.isconnected():
+            backoff_ms = min_backoff_ms
+            await asyncio.sleep_ms(check_interval_ms)
+            continue
+
+        print(f"WiFi down, reconnecting to {ssid}...")
+        if not sta.active():
+            sta.active(True)
+        try:
+            sta.disconnect()
+        except OSError:
+            pass
+        sta.connect(ssid, pwd)
+
+        deadline = time.ticks_add(time.ticks_ms(), connect_timeout_ms)
+        while not sta.isconnected() and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+            await asyncio.sleep_ms(200)
+
+        if sta.isconnected():
+            print(f"Reconnected: {sta.ifconfig()=}")
+            continue
+
+        print(f"WiFi reconnect failed, retrying in {backoff_ms}ms")
+        await asyncio.sleep_ms(backoff_ms)
+        backoff_ms = min(backoff_ms * 2, max_backoff_ms)
+
 # def provision_if_needed():
 #     sta = network.WLAN(network.STA_IF)
 #     if hasattr(sta, "isconnected") and sta.isconnected():
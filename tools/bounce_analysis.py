@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Offline bounce analysis of a recording, with every DSP stage cached on disk.
+
+Strategy:
+1) The notebook's detector is split into stages: high-pass -> block max -> short and
+   long EMAs -> bounce signal. Thresholding it is cheap and never cached.
+2) Each stage's output is keyed by sha256(stage name, its inputs' keys, its params),
+   the audio's key being the hash of its samples. Changing a parameter only changes
+   the keys of that stage and the ones downstream of it - e.g. a new threshold
+   recomputes nothing, a new long EMA alpha skips the filter and the block maxima.
+3) Outputs are .npy files opened memory-mapped, written atomically. Reads touch the
+   file's mtime; when the cache grows past its size cap the least recently used
+   files are deleted.
+
+Usage:
+  python tools/bounce_analysis.py notebooks/pingpong.wav
+  python tools/bounce_analysis.py rec.wav --threshold 4 --long-alpha 0.95 -o bounces.json
+  python tools/bounce_analysis.py rec.wav --no-cache
+
+From Python (e.g. the notebook, with tools/ on sys.path):
+  analysis = BounceAnalysis(data, 16000, cache=StageCache(), threshold=4)
+  analysis.bounce_signal, analysis.bounces()
+"""
+import sys, os, json, time, wave, hashlib, tempfile, argparse
+
+import numpy as np
+from scipy import signal
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pingpong-esp32", "analysis")
+DEFAULT_CACHE_MAX_MB = 2048
+
+# As in notebooks/analyze_demo_recording.ipynb
+DEFAULT_PARAMS = {
+    "hp_order": 4,
+    "hp_cutoff": 7500,
+    "block_size": 512,
+    "short_alpha": 0.750,
+    "short_initial": 0.0,
+    "long_alpha": 0.959,
+    "long_initial": 50.0,
+    "threshold": 5.0,
+}
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as wav_file:
+        if wav_file.getsampwidth() != 2:
+            sys.exit(f"{path}: only 16-bit PCM is supported")
+        data = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+        channels = wav_file.getnchannels()
+        sample_rate = wav_file.getframerate()
+    if channels > 1:
+        data = data.reshape(-1, channels)[:, 0]
+    return data, sample_rate
+
+
+class StageCache:
+    """Content-addressed .npy files, memory-mapped on read, LRU-evicted by mtime past max_bytes."""
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.npy")
+
+    def get(self, key):
+        path = self._file(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+        os.utime(path)  # Recently used
+        return array
+
+    def put(self, key, array):
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Atomic, so a concurrent reader never maps a half written file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+        array = np.load(path, mmap_mode="r")
+        self.evict(keep=path)
+        return array
+
+    def evict(self, keep=None):
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith(".npy") and os.path.join(root, name) != keep:
+                    st = os.stat(os.path.join(root, name))
+                    files.append((st.st_mtime, st.st_size, os.path.join(root, name)))
+        total = sum(size for _, size, _ in files) + (os.path.getsize(keep) if keep else 0)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+def _key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def _lagged_ema(x, alpha, initial):
+    """y[0] = initial, y[k+1] = alpha * y[k] + (1 - alpha) * x[k]"""
+    ema, _ = signal.lfilter([1 - alpha], [1, -alpha], x, zi=[alpha * initial])
+    return np.concatenate([[initial], ema[:-1]])
+
+
+class BounceAnalysis:
+    """
+    The detector's stages over one recording, each computed on first access and cached.
+
+    Stages are attributes (`filtered`, `block_max`, `short_ema`, `long_ema`,
+    `bounce_signal`); block-level stages have one value per `block_size` samples.
+    """
+
+    def __init__(self, audio, sample_rate, cache=None, **params):
+        unknown = set(params) - set(DEFAULT_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+        self.audio = audio
+        self.sample_rate = sample_rate
+        self.cache = cache
+        self.params = {**DEFAULT_PARAMS, **params}
+        self.timings = {}  # stage -> (seconds, cache hit)
+
+        audio_hash = hashlib.sha256(np.ascontiguousarray(audio).data).hexdigest()
+        self.keys = {"audio": _key("audio", audio_hash, str(np.asarray(audio).dtype), sample_rate)}
+        self.results = {"audio": audio}
+
+    def _stage(self, name, inputs, param_names, compute):
+        if name in self.results:
+            return self.results[name]
+
+        args = [self._get(stage) for stage in inputs]
+        params = {p: self.params[p] for p in param_names}
+        key = _key(name, [self.keys[stage] for stage in inputs], params)
+        self.keys[name] = key
+
+        start = time.perf_counter()
+        result = self.cache.get(key) if self.cache is not None else None
+        hit = result is not None
+        if not hit:
+            result = compute(*args, **params)
+            if self.cache is not None:
+                result = self.cache.put(key, result)
+        self.timings[name] = (time.perf_counter() - start, hit)
+        self.results[name] = result
+        return result
+
+    def _get(self, stage):
+        return getattr(self, stage) if stage != "audio" else self.audio
+
+    @property
+    def filtered(self):
+        def compute(audio, hp_order, hp_cutoff):
+            sos = signal.butter(hp_order, hp_cutoff, btype="highpass", fs=self.sample_rate, output="sos")
+            return signal.sosfilt(sos, audio)
+        return self._stage("filtered", ["audio"], ["hp_order", "hp_cutoff"], compute)
+
+    @property
+    def block_max(self):
+        def compute(filtered, block_size):
+            n_blocks = -(-len(filtered) // block_size)
+            padded = np.zeros(n_blocks * block_size)
+            padded[:len(filtered)] = np.abs(filtered)
+            return padded.reshape(n_blocks, block_size).max(axis=1)
+        return self._stage("block_max", ["filtered"], ["block_size"], compute)
+
+    @property
+    def short_ema(self):
+        return self._stage("short_ema", ["block_max"], ["short_alpha", "short_initial"],
+                           lambda block_max, short_alpha, short_initial: _lagged_ema(block_max, short_alpha, short_initial))
+
+    @property
+    def long_ema(self):
+        return self._stage("long_ema", ["block_max"], ["long_alpha", "long_initial"],
+                           lambda block_max, long_alpha, long_initial: _lagged_ema(block_max, long_alpha, long_initial))
+
+    @property
+    def bounce_signal(self):
+        return self._stage("bounce_signal", ["block_max", "short_ema", "long_ema"], [],
+                           lambda block_max, short_ema, long_ema: (block_max - short_ema) / long_ema)
+
+    def bounces(self):
+        """Bounce times in seconds (the start of each block above the threshold)."""
+        blocks = np.flatnonzero(self.bounce_signal > self.params["threshold"])
+        return blocks * self.params["block_size"] / self.sample_rate
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("wav", help="16-bit PCM recording")
+    ap.add_argument("-o", "--output", help="write the bounce times (s) as a JSON list")
+    for name, default in DEFAULT_PARAMS.items():
+        ap.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    ap.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_MB)
+    ap.add_argument("--no-cache", action="store_true")
+    args = ap.parse_args()
+
+    data, sample_rate = read_wav(args.wav)
+    cache = None if args.no_cache else StageCache(args.cache_dir, args.cache_max_mb * 2**20)
+    analysis = BounceAnalysis(data, sample_rate, cache=cache,
+                              **{name: getattr(args, name) for name in DEFAULT_PARAMS})
+    bounces = analysis.bounces()
+
+    for stage, (secs, hit) in analysis.timings.items():
+        print(f"{stage:14s} {secs * 1000:8.1f} ms  {'cached' if hit else 'computed'}")
+    print(f"{len(bounces)} bounces in {len(data) / sample_rate:.1f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump([round(float(t), 4) for t in bounces], f)
+
+
+if __name__ == "__main__":
+    main()
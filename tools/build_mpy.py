@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Cross-compile the device/ tree to .mpy bytecode.
+
+Strategy:
+1) Every module under device/ is compiled with mpy-cross into build/device/,
+   keeping the layout. boot.py and main.py stay as source - MicroPython only runs
+   them as .py - but everything they import is precompiled.
+2) -march (xtensawin for the classic ESP32) lets @micropython.native / viper
+   functions (e.g. the fused detector kernel) compile to machine code.
+3) Non-Python files (config.json, secrets.json, ...) are copied as is.
+4) (Optional) --frozen-manifest writes build/manifest.py for freezing the same
+   modules into a custom firmware build (FROZEN_MANIFEST=...).
+5) (Optional) --measure PORT imports every module on a board and reports import
+   time and gc.mem_free() - run it once after syncing the sources and once after
+   syncing the build to compare.
+
+mpy-cross must match the firmware's bytecode version (`pip install mpy-cross==<fw version>`).
+
+Usage:
+  python tools/build_mpy.py                          # build/device/
+  python tools/build_mpy.py --frozen-manifest        # + build/manifest.py
+  python tools/sync_device.py --src build/device --port P
+  python tools/build_mpy.py --measure P              # import time / heap on the board
+"""
+import sys, os, shutil, subprocess, argparse
+
+SOURCE_ONLY = {"boot.py", "main.py"}
+EXCLUDE_DIRS = {"__pycache__"}
+EXCLUDE_NAMES = {".gitkeep", ".DS_Store"}
+MPREMOTE = [sys.executable, "-m", "mpremote"]
+
+
+def find_mpy_cross(explicit=None):
+    exe = explicit or shutil.which("mpy-cross")
+    if not exe:
+        sys.exit("mpy-cross not found (pip install mpy-cross, matching the firmware version)")
+    return exe
+
+
+def device_files(src):
+    """Relative paths of every file under src."""
+    for root, dirs, files in os.walk(src):
+        dirs[:] = sorted(d for d in dirs if d not in EXCLUDE_DIRS)
+        for name in sorted(files):
+            if name in EXCLUDE_NAMES or name.endswith(".pyc"):
+                continue
+            yield os.path.relpath(os.path.join(root, name), src)
+
+
+def is_compiled(rel):
+    return rel.endswith(".py") and rel not in SOURCE_ONLY
+
+
+def module_name(rel):
+    return os.path.splitext(rel)[0].replace(os.sep, ".")
+
+
+def build(src, out, mpy_cross, arch, opt_level):
+    if os.path.exists(out):
+        shutil.rmtree(out)
+
+    compiled = []
+    for rel in device_files(src):
+        src_path = os.path.join(src, rel)
+        os.makedirs(os.path.dirname(os.path.join(out, rel)), exist_ok=True)
+        if not is_compiled(rel):
+            shutil.copy2(src_path, os.path.join(out, rel))
+            continue
+
+        out_path = os.path.join(out, os.path.splitext(rel)[0] + ".mpy")
+        # -s keeps tracebacks pointing at the device path rather than the build host's
+        cmd = [mpy_cross, f"-O{opt_level}", "-s", rel.replace(os.sep, "/"), "-o", out_path, src_path]
+        if arch:
+            cmd.insert(1, f"-march={arch}")
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=False)
+        if proc.returncode != 0:
+            sys.exit(f"mpy-cross failed on {rel}:\n{proc.stdout}")
+        compiled.append(rel)
+
+    src_size = sum(os.path.getsize(os.path.join(src, rel)) for rel in compiled)
+    out_size = sum(os.path.getsize(os.path.join(out, os.path.splitext(rel)[0] + ".mpy")) for rel in compiled)
+    print(f"Compiled {len(compiled)} modules to {out}: {src_size} -> {out_size} bytes")
+    return compiled
+
+
+def write_frozen_manifest(src, compiled, path):
+    """Manifest for a custom firmware build; boot.py/main.py and data files stay on the filesystem."""
+    modules = ",\n".join(f"        {rel.replace(os.sep, '/')!r}" for rel in compiled)
+    with open(path, "w") as f:
+        f.write('include("$(PORT_DIR)/boards/manifest.py")\n')
+        f.write(f"freeze(\n    {os.path.abspath(src)!r},\n    (\n{modules},\n    ),\n    opt=3,\n)\n")
+    print(f"Frozen-module manifest written to {path}")
+
+
+def measure(port, modules):
+    """Import every module on the board, reporting the time taken and the heap it costs."""
+    script = "\n".join([
+        "import gc, time",
+        "gc.collect()",
+        "free_start = gc.mem_free()",
+        f"for name in {modules!r}:",
+        "    gc.collect()",
+        "    free_before = gc.mem_free()",
+        "    t0 = time.ticks_us()",
+        "    __import__(name)",
+        "    dt = time.ticks_diff(time.ticks_us(), t0)",
+        "    gc.collect()",
+        "    print('%-24s %8.1f ms %8d bytes' % (name, dt / 1000, free_before - gc.mem_free()))",
+        "gc.collect()",
+        "print('total heap used: %d bytes, free: %d bytes' % (free_start - gc.mem_free(), gc.mem_free()))",
+    ])
+    cmd = MPREMOTE + ["connect", port, "sleep", "1", "exec", script]
+    subprocess.run(cmd, check=False)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--src", default="device", help="device tree to compile (default: device)")
+    ap.add_argument("--out", default="build/device", help="output tree (default: build/device)")
+    ap.add_argument("--arch", default="xtensawin", help="mpy-cross -march for native/viper code ('' to disable)")
+    ap.add_argument("-O", dest="opt_level", type=int, default=2, help="mpy-cross optimisation level (default: 2)")
+    ap.add_argument("--mpy-cross", help="path to mpy-cross (default: from PATH)")
+    ap.add_argument("--frozen-manifest", action="store_true", help="also write build/manifest.py for custom firmware")
+    ap.add_argument("--measure", metavar="PORT", help="measure import time and heap usage on the board at PORT")
+    args = ap.parse_args()
+
+    if args.measure:
+        modules = [module_name(rel) for rel in device_files(args.src) if is_compiled(rel)]
+        measure(args.measure, modules)
+        return
+
+    compiled = build(args.src, args.out, find_mpy_cross(args.mpy_cross), args.arch, args.opt_level)
+    if args.frozen_manifest:
+        write_frozen_manifest(args.src, compiled, os.path.join(os.path.dirname(args.out), "manifest.py"))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,16 +5,23 @@ Detect the ESP32 serial port robustly.
 Strategy:
 1) Score ports by USB VID/PID + product/manufacturer strings typical of ESP32
    boards and their USB-UART bridges (CP210x, CH340, FTDI, Prolific, Espressif).
-2) (Optional) --probe: confirm by talking to the bootloader via esptool.
-3) Print the best matching port to stdout. Use --list to see details.
+2) (Optional) --probe: confirm by talking to the bootloader via esptool. All
+   candidates are probed concurrently, and confirmed boards are cached (keyed by
+   USB serial number + VID:PID) for --cache-ttl seconds, so repeat calls return
+   immediately.
+3) Print the best matching port to stdout. Use --list to see details, or --all
+   to print every ESP32 found with its chip type.
 
 Usage:
   python tools/detect_port.py              # print best guess
   python tools/detect_port.py --probe      # verify with esptool before printing
   python tools/detect_port.py --list       # show all candidate ports & scores
+  python tools/detect_port.py --all        # every ESP32 board: port, chip, serial
+  python tools/detect_port.py --probe --no-cache   # ignore cached probe results
   PORT=$(python tools/detect_port.py --probe) make run
 """
-import sys, shutil, subprocess, argparse
+import os, re, json, time, shutil, tempfile, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
 from serial.tools import list_ports
 
 # Known vendors (VID) and bridges often used with ESP32 dev boards
@@ -26,6 +33,16 @@ KNOWN_VIDS = {
     0x067B: "Prolific",       # PL2303
 }
 
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pingpong-esp32", "ports.json")
+DEFAULT_CACHE_TTL = 3600
+
+# esptool v4 prints "Chip is ESP32-D0WD-V3 (revision v3.0)", v5 "Chip type: ESP32-D0WD-V3 (...)"
+CHIP_PATTERNS = (
+    re.compile(r"Chip is (.+)"),
+    re.compile(r"Chip type:\s+(.+)"),
+    re.compile(r"Detecting chip type\.*\s*(\S+)"),
+)
+
 KEYWORDS = (
     "esp32", "espressif", "usb jtag", "cp210", "ch340", "ftdi", "pl2303",
     "usb-serial", "usb serial"
@@ -62,6 +79,60 @@ def esptool_probe(port, timeout=8):
     except Exception as e:
         return False, str(e)
 
+def parse_chip(output):
+    for pattern in CHIP_PATTERNS:
+        m = pattern.search(output)
+        if m:
+            return m.group(1).strip()
+    return None
+
+def cache_key(p):
+    """Identify the physical board: USB serial number + VID:PID (port path if there's no serial)."""
+    return f"{p.serial_number or p.device}|{p.vid or 0:04X}:{p.pid or 0:04X}"
+
+def load_cache(ttl):
+    try:
+        with open(CACHE_PATH) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    return {k: v for k, v in cache.items() if now - v.get("ts", 0) < ttl}
+
+def save_cache(cache):
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    # Atomic replace, so concurrent invocations never read a half-written file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(CACHE_PATH))
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f, indent=1)
+    os.replace(tmp, CACHE_PATH)
+
+def probe_all(ports, use_cache=True, ttl=DEFAULT_CACHE_TTL, timeout=8):
+    """
+    {device: chip type or None} for the given ports. Cache misses are probed with esptool
+    concurrently. Only confirmed boards are cached - a busy or sleeping port is retried.
+    """
+    cache = load_cache(ttl) if use_cache else {}
+    results = {}
+    to_probe = []
+    for p in ports:
+        hit = cache.get(cache_key(p))
+        if hit is not None:
+            results[p.device] = hit["chip"]
+        else:
+            to_probe.append(p)
+
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=len(to_probe)) as pool:
+            outcomes = list(pool.map(lambda p: esptool_probe(p.device, timeout), to_probe))
+        for p, (ok, output) in zip(to_probe, outcomes):
+            chip = (parse_chip(output) or "ESP32 (unknown)") if ok else None
+            results[p.device] = chip
+            if chip:
+                cache[cache_key(p)] = {"device": p.device, "chip": chip, "ts": time.time()}
+        save_cache(cache)
+    return results
+
 def list_candidates():
     ports = list(list_ports.comports())
     # prefer cu.* duplicates on mac if both tty.* and cu.* exist for same base
@@ -80,6 +151,9 @@ def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--probe", action="store_true", help="verify with esptool before printing")
     ap.add_argument("--list", action="store_true", help="list candidates with scores")
+    ap.add_argument("--all", action="store_true", help="probe and print every ESP32 found with its chip type")
+    ap.add_argument("--no-cache", action="store_true", help="ignore cached probe results")
+    ap.add_argument("--cache-ttl", type=int, default=DEFAULT_CACHE_TTL, help="seconds a probe result stays valid")
     args = ap.parse_args()
 
     candidates = list_candidates()
@@ -96,13 +170,18 @@ def main():
                   f"{p.manufacturer or ''} {p.product or ''}  [{p.description}]")
         return
 
+    if args.all:
+        chips = probe_all(scored, use_cache=not args.no_cache, ttl=args.cache_ttl)
+        for p in scored:
+            if chips[p.device]:
+                print(f"{p.device:30} {chips[p.device]:40} "
+                      f"VID:PID={p.vid or 0:04X}:{p.pid or 0:04X}  serial={p.serial_number or '-'}")
+        return
+
     best = None
     if args.probe:
-        for p in scored:
-            ok, _ = esptool_probe(p.device)
-            if ok:
-                best = p
-                break
+        chips = probe_all(scored, use_cache=not args.no_cache, ttl=args.cache_ttl)
+        best = next((p for p in scored if chips[p.device]), None)
     if best is None:
         best = scored[0]
 
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Load test the backend with bounce events (and optionally audio frames).
+
+Strategy:
+1) --concurrency clients post bounce events as fast as the backend answers, spread
+   over --rooms rooms, for --duration seconds.
+2) With --audio-fraction, that share of the requests posts a 640-sample
+   /audio-samples frame instead, like a device in mic-test mode, as one of
+   --audio-devices devices (X-Device-Id).
+3) Throughput and latency percentiles are reported per endpoint. Frames the backend
+   refuses (429, over the device's rate or shed) are counted apart from errors.
+
+Run it against the same config with server.workers=1 and then N (shared_state.backend
+"sqlite") to see how throughput scales. Point the notifier at a test channel - every
+room that turns taken posts to Slack.
+
+Usage:
+  python tools/load_test.py --url http://localhost:12345
+  python tools/load_test.py --url http://localhost:12345 --concurrency 64 --rooms 8 --duration 20
+  python tools/load_test.py --url http://localhost:12345 --audio-fraction 0.5
+  python tools/load_test.py --url http://localhost:12345 --audio-fraction 0.9 --audio-devices 1
+"""
+import asyncio, time, random, argparse
+
+import aiohttp
+import numpy as np
+
+AUDIO_FRAME_SAMPLES = 640
+
+
+async def client(session, url, args, deadline, results, client_id):
+    samples = np.random.randint(-2**15, 2**15, AUDIO_FRAME_SAMPLES).tolist()
+    bounce_ctr = 0
+    while time.perf_counter() < deadline:
+        headers = {}
+        if random.random() < args.audio_fraction:
+            endpoint = "/audio-samples"
+            body = {"samples": samples, "is_bounce": False, "sample_rate": 16000}
+            headers["X-Device-Id"] = f"load-test-{client_id % args.audio_devices}"
+        else:
+            endpoint = "/pingpong-event"
+            bounce_ctr += 1
+            body = {"type": "bounce-detected", "bounce_ctr": bounce_ctr,
+                    "room": f"room-{(client_id + bounce_ctr) % args.rooms}"}
+
+        start = time.perf_counter()
+        try:
+            async with session.post(url + endpoint, json=body, headers=headers) as response:
+                await response.read()
+                status = response.status
+        except aiohttp.ClientError:
+            status = None
+        results.setdefault(endpoint, []).append((time.perf_counter() - start, status))
+
+
+async def run(args):
+    url = args.url.rstrip("/")
+    results = {}
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(*(client(session, url, args, deadline, results, i) for i in range(args.concurrency)))
+
+    total = 0
+    for endpoint, samples in sorted(results.items()):
+        latencies = np.array([latency for latency, _ in samples]) * 1000
+        refused = sum(1 for _, status in samples if status == 429)
+        errors = sum(1 for _, status in samples if status not in (200, 429))
+        total += len(samples)
+        print(f"{endpoint:16s} {len(samples) / args.duration:8.1f} req/s  errors={errors}  refused={refused}  "
+              f"p50={np.percentile(latencies, 50):.1f}ms  p90={np.percentile(latencies, 90):.1f}ms  "
+              f"p99={np.percentile(latencies, 99):.1f}ms")
+    print(f"{'total':16s} {total / args.duration:8.1f} req/s")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://localhost:12345", help="backend base URL")
+    ap.add_argument("--concurrency", type=int, default=32, help="concurrent clients (default: 32)")
+    ap.add_argument("--rooms", type=int, default=4, help="rooms the events are spread over (default: 4)")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds to run (default: 10)")
+    ap.add_argument("--audio-fraction", type=float, default=0.0, help="share of requests posting audio frames")
+    ap.add_argument("--audio-devices", type=int, default=1, help="devices the audio frames are spread over (default: 1)")
+    ap.add_argument("--timeout", type=float, default=10.0, help="per-request timeout in seconds")
+    args = ap.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Render a bounce-detection review video from a recording.
+
+Strategy:
+1) The timeline is split into pages of --page-secs; each page shows its part of the
+   waveform (a min/max envelope, one pair per pixel column - an hour of audio is never
+   plotted sample by sample) and its bounce markers.
+2) A page's static layers are drawn once and saved as the blitting background. Each
+   video frame only restores it and draws the animated artists: cursor, bounce flash,
+   counters.
+3) Pages are grouped into chunks rendered on a process pool, each piping raw frames to
+   its own ffmpeg (imageio-ffmpeg's bundled binary) as a video-only segment.
+4) The segments are joined with ffmpeg's concat demuxer (no re-encode) and the audio
+   track is muxed in.
+
+Bounces come from --bounces (JSON list of seconds, or one per line) or are detected
+with tools/bounce_analysis.py, whose cached stages make re-rendering with the same
+detector parameters skip the analysis.
+
+Usage:
+  python tools/render_bounce_video.py notebooks/pingpong.wav -o review.mp4
+  python tools/render_bounce_video.py rec.wav -o review.mp4 --start 60 --duration 600 --jobs 8
+  python tools/render_bounce_video.py rec.wav -o review.mp4 --bounces bounces.json
+"""
+import sys, os, json, time, wave, shutil, tempfile, subprocess, argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bounce_analysis import DEFAULT_CACHE_DIR, BounceAnalysis, StageCache, read_wav
+
+FLASH_SECS = 0.4
+WIDTH, HEIGHT, DPI = 1280, 720, 80
+
+
+def write_wav(path, data, sample_rate):
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(np.ascontiguousarray(data, dtype=np.int16).tobytes())
+
+
+def load_bounces(path):
+    with open(path) as f:
+        text = f.read()
+    try:
+        return np.asarray(json.loads(text), dtype=float)
+    except ValueError:
+        return np.asarray([float(line) for line in text.split()], dtype=float)
+
+
+def envelope(samples, n_columns):
+    """Min/max per pixel column."""
+    n = len(samples) - len(samples) % n_columns if len(samples) >= n_columns else 0
+    if n == 0:
+        return samples.astype(float), samples.astype(float)
+    columns = samples[:n].reshape(n_columns, -1)
+    return columns.min(axis=1).astype(float), columns.max(axis=1).astype(float)
+
+
+class PageRenderer:
+    """One figure per process; `render_page` redraws the static layers, frames are blitted on top."""
+
+    def __init__(self, audio, sample_rate, bounces, start, end, page_secs, y_limit):
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib import pyplot as plt
+        from matplotlib.patches import Rectangle
+
+        self.audio = audio
+        self.sample_rate = sample_rate
+        self.bounces = bounces
+        self.start = start
+        self.end = end
+        self.page_secs = page_secs
+
+        self.fig, self.ax = plt.subplots(figsize=(WIDTH / DPI, HEIGHT / DPI), dpi=DPI, facecolor="black")
+        ax = self.ax
+        ax.set_facecolor("black")
+        ax.set_xlabel("Time (s)", fontsize=14, color="white")
+        ax.set_ylabel("Amplitude", fontsize=14, color="white")
+        ax.set_title("Ping Pong Bounce Detection", fontsize=18, fontweight="bold", color="white")
+        ax.grid(True, alpha=0.2, color="gray")
+        ax.tick_params(colors="white")
+        ax.set_ylim(-y_limit, y_limit)
+        self.fig.tight_layout()
+
+        # Animated artists: left out of the background, drawn every frame
+        self.flash = ax.add_patch(Rectangle((0, 0), 1, 1, transform=ax.get_xaxis_transform(), color="red",
+                                            alpha=0, zorder=1, animated=True))
+        self.current_bounce = ax.axvline(0, color="red", linewidth=4, visible=False, animated=True)
+        self.cursor = ax.axvline(0, color="lime", linewidth=3, zorder=10, alpha=0.9, animated=True)
+        self.banner = ax.text(0.5, 0.95, "BOUNCE DETECTED!", transform=ax.transAxes, fontsize=36,
+                              fontweight="bold", color="white", ha="center", va="top", visible=False,
+                              bbox=dict(boxstyle="round", facecolor="red", edgecolor="yellow", linewidth=3, pad=0.8),
+                              animated=True)
+        box = dict(boxstyle="round", facecolor="black", alpha=0.7, pad=0.5)
+        self.progress = ax.text(0.02, 0.98, "", transform=ax.transAxes, fontsize=13, color="white",
+                                va="top", bbox=box, animated=True)
+        self.counter = ax.text(0.98, 0.98, "", transform=ax.transAxes, fontsize=13, color="white",
+                               ha="right", va="top", bbox=box, animated=True)
+        self.animated = [self.flash, self.current_bounce, self.cursor, self.banner, self.progress, self.counter]
+        self.static = []
+        self.background = None
+
+    def render_page(self, page_start):
+        for artist in self.static:
+            artist.remove()
+        page_end = page_start + self.page_secs
+        ax = self.ax
+        ax.set_xlim(page_start, page_end)
+
+        first = max(0, int((page_start - self.start) * self.sample_rate))
+        last = min(len(self.audio), int((min(page_end, self.end) - self.start) * self.sample_rate))
+        n_columns = int(ax.bbox.width)
+        mins, maxs = envelope(np.asarray(self.audio[first:last]), n_columns)
+        x = self.start + np.linspace(first, last, len(mins), endpoint=False) / self.sample_rate
+        self.static = [ax.fill_between(x, mins, maxs, color="cyan", alpha=0.6, linewidth=0.5)]
+        in_page = self.bounces[(self.bounces >= page_start) & (self.bounces < page_end)]
+        self.static += [ax.axvline(b, color="red", alpha=0.3, linewidth=1, linestyle="--") for b in in_page]
+
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.flash.set_x(page_start)
+        self.flash.set_width(self.page_secs)
+
+    def render_frame(self, t):
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+
+        n_so_far = int(np.searchsorted(self.bounces, t, side="right"))
+        since_bounce = t - self.bounces[n_so_far - 1] if n_so_far else np.inf
+        flashing = since_bounce <= FLASH_SECS
+        flash_alpha = 1 - since_bounce / FLASH_SECS if flashing else 0
+
+        self.flash.set_alpha(flash_alpha * 0.3)
+        self.current_bounce.set_visible(flashing)
+        if flashing:
+            self.current_bounce.set_xdata([self.bounces[n_so_far - 1]] * 2)
+        self.banner.set_visible(flashing)
+        self.banner.get_bbox_patch().set_alpha(flash_alpha)
+        self.cursor.set_xdata([t, t])
+        duration = self.end - self.start
+        self.progress.set_text(f"{t:.2f}s / {self.end:.1f}s  ({(t - self.start) / duration * 100:.0f}%)")
+        self.counter.set_text(f"Bounces: {n_so_far}/{len(self.bounces)}")
+
+        for artist in self.animated:
+            self.ax.draw_artist(artist)
+        canvas.blit(self.fig.bbox)
+        return np.asarray(canvas.buffer_rgba())[:, :, :3]
+
+
+def render_chunk(job):
+    """Render frames [first_frame, last_frame) to a video-only segment."""
+    import imageio_ffmpeg
+
+    audio = np.load(job["audio_path"], mmap_mode="r")
+    renderer = PageRenderer(audio, job["sample_rate"], job["bounces"], job["start"], job["end"],
+                            job["page_secs"], job["y_limit"])
+    fps = job["fps"]
+    frames_per_page = job["frames_per_page"]
+
+    writer = imageio_ffmpeg.write_frames(job["output"], (WIDTH, HEIGHT), fps=fps, codec="libx264",
+                                         quality=None, bitrate=job["bitrate"], macro_block_size=1,
+                                         output_params=["-preset", job["preset"]])
+    writer.send(None)
+    try:
+        page = None
+        for frame in range(job["first_frame"], job["last_frame"]):
+            if frame // frames_per_page != page:
+                page = frame // frames_per_page
+                renderer.render_page(job["start"] + page * frames_per_page / fps)
+            writer.send(np.ascontiguousarray(renderer.render_frame(job["start"] + frame / fps)))
+    finally:
+        writer.close()
+    return job["output"]
+
+
+def concat(segments, audio_wav, output, workdir):
+    import imageio_ffmpeg
+
+    list_path = os.path.join(workdir, "segments.txt")
+    with open(list_path, "w") as f:
+        for segment in segments:
+            f.write(f"file '{segment}'\n")
+    cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+           "-f", "concat", "-safe", "0", "-i", list_path, "-i", audio_wav,
+           "-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "aac", "-shortest", output]
+    subprocess.run(cmd, check=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("wav", help="16-bit PCM recording")
+    ap.add_argument("-o", "--output", default="bounce_detection.mp4", help="output video")
+    ap.add_argument("--bounces", help="bounce times in seconds (JSON list or one per line); detected if omitted")
+    ap.add_argument("--start", type=float, default=0.0, help="start time in seconds")
+    ap.add_argument("--duration", type=float, help="seconds to render (default: until the end)")
+    ap.add_argument("--page-secs", type=float, default=10.0, help="seconds of waveform shown at once (default: 10)")
+    ap.add_argument("--fps", type=int, default=30)
+    ap.add_argument("--jobs", type=int, default=os.cpu_count(), help="rendering processes (default: all cores)")
+    ap.add_argument("--pages-per-chunk", type=int, default=3, help="pages per parallel job (default: 3)")
+    ap.add_argument("--bitrate", default="2000k")
+    ap.add_argument("--preset", default="veryfast", help="x264 preset (default: veryfast)")
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="bounce analysis cache")
+    ap.add_argument("--no-cache", action="store_true", help="don't cache the bounce analysis")
+    args = ap.parse_args()
+
+    started = time.time()
+    data, sample_rate = read_wav(args.wav)
+    if args.bounces:
+        bounces = load_bounces(args.bounces)
+    else:
+        cache = None if args.no_cache else StageCache(args.cache_dir)
+        bounces = BounceAnalysis(data, sample_rate, cache=cache).bounces()
+
+    first_sample = int(args.start * sample_rate)
+    last_sample = len(data) if args.duration is None else min(len(data), first_sample + int(args.duration * sample_rate))
+    segment = data[first_sample:last_sample]
+    if len(segment) == 0:
+        sys.exit("Nothing to render")
+    start = first_sample / sample_rate
+    end = last_sample / sample_rate
+    bounces = np.sort(bounces[(bounces >= start) & (bounces < end)])
+    print(f"Rendering {end - start:.1f}s with {len(bounces)} bounces")
+
+    # Whole frames per page, so pages and chunks fall on frame boundaries
+    frames_per_page = max(1, round(args.page_secs * args.fps))
+    page_secs = frames_per_page / args.fps
+    n_frames = int((end - start) * args.fps)
+    frames_per_chunk = frames_per_page * args.pages_per_chunk
+    # Fixed y-axis for the whole video; ignore the odd clipping spike
+    y_limit = max(1.0, float(np.percentile(np.abs(segment), 99.99)) * 1.1)
+
+    workdir = tempfile.mkdtemp(prefix="bounce-video-")
+    try:
+        audio_path = os.path.join(workdir, "audio.npy")
+        np.save(audio_path, segment)
+        audio_wav = os.path.join(workdir, "audio.wav")
+        peak = max(1, int(np.max(np.abs(segment.astype(np.int32)))))
+        write_wav(audio_wav, (segment.astype(np.int32) * 32767 // peak).astype(np.int16), sample_rate)
+
+        jobs = []
+        for i, first_frame in enumerate(range(0, n_frames, frames_per_chunk)):
+            jobs.append({
+                "audio_path": audio_path, "sample_rate": sample_rate, "bounces": bounces,
+                "start": start, "end": end, "page_secs": page_secs, "y_limit": y_limit,
+                "fps": args.fps, "frames_per_page": frames_per_page,
+                "first_frame": first_frame, "last_frame": min(n_frames, first_frame + frames_per_chunk),
+                "output": os.path.join(workdir, f"segment-{i:05d}.mp4"),
+                "bitrate": args.bitrate, "preset": args.preset,
+            })
+
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            segments = []
+            for n_done, path in enumerate(pool.map(render_chunk, jobs), start=1):
+                segments.append(path)
+                print(f"\r{n_done}/{len(jobs)} chunks", end="", flush=True)
+        print()
+
+        concat(segments, audio_wav, args.output, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    elapsed = time.time() - started
+    print(f"Wrote {args.output}: {end - start:.1f}s of video in {elapsed:.1f}s ({(end - start) / elapsed:.1f}x real time)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded session (backend `recording.enabled`) through the backend pipeline.
+
+Strategy:
+1) The recording's events and debug audio frames are merged into one timeline by
+   receipt time. Audio frames are read back from audio.wav at their sample offsets.
+2) Over HTTP, each item is posted to /pingpong-event or /audio-samples of a running
+   backend when its time comes, at --speed times the original pace ("max": no waiting).
+   Capture and send times are moved onto the replay's clock, keeping their distance to
+   the receipt. The backend's idle countdown still runs on its wall clock. Event ids get a
+   suffix per run, else the backend would drop a second replay (or one into the backend
+   that recorded the session) as duplicates; --keep-event-ids sends them unchanged.
+   Frames go out with their device's X-Device-Id, as devices send them: the backend
+   rate-limits audio per device (ingest.audio_rate_per_device, 30 frames/s by default,
+   about 1x of a debug device), so audio above ~1x needs a higher rate there, or
+   --skip-audio.
+3) With --in-process, the Controller runs here on a VirtualClock and is fed directly:
+   the clock jumps from one recorded time to the next, so countdowns (10 minutes by
+   default) complete without waiting and a whole evening replays in seconds at "max".
+   Room notifications are printed instead of posted to Slack.
+
+Usage:
+  python tools/replay_session.py recordings/20261017-190102-host-42 --url http://localhost:12345
+  python tools/replay_session.py recordings/20261017-190102-host-42 --url http://localhost:12345 --speed 10
+  python tools/replay_session.py recordings/20261017-190102-host-42 --in-process --speed max
+"""
+import sys, os, json, time, asyncio, argparse, uuid
+
+import aiohttp
+
+from bounce_analysis import read_wav
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+# As written by backend/recorder.py
+EVENTS_FILE = "events.jsonl"
+AUDIO_FILE = "audio.wav"
+AUDIO_INDEX_FILE = "audio.jsonl"
+
+
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        # A recording cut short may end with a partial line
+        return [json.loads(line) for line in f if line.endswith("\n")]
+
+
+def load_timeline(path):
+    """[(received_at_ms, "event" | "audio", payload)], in receipt order. Audio samples are loaded lazily."""
+    timeline = [(record["received_at_ms"], "event", record["event"]) for record in _read_jsonl(os.path.join(path, EVENTS_FILE))]
+
+    index = _read_jsonl(os.path.join(path, AUDIO_INDEX_FILE))
+    if index:
+        audio, _ = read_wav(os.path.join(path, AUDIO_FILE))
+        for record in index:
+            frame = dict(record)
+            received_at_ms, offset, n = frame.pop("received_at_ms"), frame.pop("offset"), frame.pop("n")
+            timeline.append((received_at_ms, "audio", (frame, audio, offset, n)))
+
+    timeline.sort(key=lambda item: item[0])  # Stable - a batch's events keep their order
+    return timeline
+
+
+def _audio_frame(payload):
+    frame, audio, offset, n = payload
+    return {**frame, "samples": audio[offset:offset + n].tolist()}
+
+
+class Pacer:
+    """Waits until an item's time, scaled by the speed-up, and tracks how far behind the replay ran."""
+
+    def __init__(self, first_ms, speed):
+        self.first_ms = first_ms
+        self.speed = speed  # None: as fast as possible
+        self.start = None
+        self.max_lag_ms = 0.0
+
+    async def wait(self, t_ms):
+        if self.speed is None:
+            return
+        if self.start is None:
+            self.start = time.perf_counter()
+        delay = self.start + (t_ms - self.first_ms) / 1000 / self.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            self.max_lag_ms = max(self.max_lag_ms, -delay * 1000)
+
+
+async def replay_http(timeline, args, pacer):
+    url = args.url.rstrip("/")
+    run_nonce = uuid.uuid4().hex[:8]
+    counts = {}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=args.timeout)) as session:
+        for t_ms, kind, payload in timeline:
+            await pacer.wait(t_ms)
+            if kind == "event":
+                endpoint, body = "/pingpong-event", dict(payload)
+                shift_ms = time.time_ns() // 1_000_000 - t_ms
+                for key in ("captured_at_ms", "sent_at_ms"):
+                    if body.get(key) is not None:
+                        body[key] += shift_ms
+                if body.get("event_id") is not None and not args.keep_event_ids:
+                    body["event_id"] = f"{body['event_id']}-r{run_nonce}"
+            else:
+                endpoint, body = "/audio-samples", _audio_frame(payload)
+            headers = {"X-Device-Id": body["device_id"]} if body.get("device_id") else None
+
+            try:
+                async with session.post(url + endpoint, json=body, headers=headers) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            counts[(endpoint, status)] = counts.get((endpoint, status), 0) + 1
+
+    for (endpoint, status), n in sorted(counts.items(), key=str):
+        print(f"{endpoint:16s} {status}: {n}")
+
+
+class _PrintNotifier:
+    def __init__(self, clock):
+        self.clock = clock
+        self.notifications = 0
+
+    async def notify(self, room_state):
+        self.notifications += 1
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.clock.time()))}  {room_state.room}: {room_state.state}")
+
+
+async def replay_in_process(timeline, args, pacer):
+    sys.path.insert(0, BACKEND_DIR)
+    from audio_stream import AudioStreamHub
+    from clock import VirtualClock
+    from config_utils import load_config
+    from controller import Controller
+    from shared_state import AUDIO_FRAMES_CHANNEL, DEFAULT_ROOM, LocalPubSub
+
+    cfg = load_config(args.config)
+    clock = VirtualClock(start=timeline[0][0] / 1000)
+    notifier = _PrintNotifier(clock)
+    pubsub = LocalPubSub("replay")
+    audio_hub = AudioStreamHub()
+    pubsub.subscribe(AUDIO_FRAMES_CHANNEL, audio_hub.broadcast)
+    controller = Controller(cfg["controller"], notifier, pubsub=pubsub, clock=clock)
+
+    rooms, errors = set(), 0
+    for t_ms, kind, payload in timeline:
+        await pacer.wait(t_ms)
+        await clock.advance_to(t_ms / 1000)
+        if kind == "audio":
+            await pubsub.publish(AUDIO_FRAMES_CHANNEL, _audio_frame(payload))
+            continue
+        try:
+            await controller.handle_event(payload, received_at_ms=t_ms)
+            rooms.add(payload.get("room", DEFAULT_ROOM))
+        except ValueError as e:
+            errors += 1
+            print(f"Skipped event: {e}")
+
+    # Let the last countdowns run out
+    await clock.advance(controller.time_without_event_to_declare_idle_secs + 1)
+
+    print(f"{notifier.notifications} room notifications, {errors} invalid events")
+    for room in sorted(rooms):
+        stats = await controller.get_session_stats(room)
+        print(f"{room}: {stats['bounces']} bounces, {stats['rallies']} rallies, {stats['games']} games, "
+              f"{stats['sessions']} sessions, longest rally {stats['longest_rally_bounces']} bounces")
+    await controller.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("recording", help="recording directory (backend recording.path/<run>)")
+    ap.add_argument("--url", default="http://localhost:12345", help="backend base URL")
+    ap.add_argument("--in-process", action="store_true", help="feed a Controller on a virtual clock instead of the backend")
+    ap.add_argument("--config", default=os.path.join(BACKEND_DIR, "config.json"), help="backend config (--in-process)")
+    ap.add_argument("--speed", default="1", help="speed-up over the recorded pace, or 'max' (default: 1)")
+    ap.add_argument("--keep-event-ids", action="store_true",
+                    help="send the recorded event ids unchanged; the backend drops ids it has already handled")
+    ap.add_argument("--skip-audio", action="store_true",
+                    help="replay events only; over HTTP, audio above ~1x needs a higher backend ingest.audio_rate_per_device")
+    ap.add_argument("--timeout", type=float, default=10.0, help="per-request timeout in seconds")
+    args = ap.parse_args()
+
+    speed = None if args.speed == "max" else float(args.speed)
+    if speed is not None and speed <= 0:
+        sys.exit("--speed must be positive or 'max'")
+
+    timeline = load_timeline(args.recording)
+    if args.skip_audio:
+        timeline = [item for item in timeline if item[1] == "event"]
+    if not timeline:
+        sys.exit(f"{args.recording}: nothing to replay")
+    n_events = sum(1 for _, kind, _ in timeline if kind == "event")
+    duration_secs = (timeline[-1][0] - timeline[0][0]) / 1000
+    print(f"Replaying {n_events} events and {len(timeline) - n_events} audio frames over {duration_secs:.1f}s")
+
+    pacer = Pacer(timeline[0][0], speed)
+    start = time.perf_counter()
+    asyncio.run(replay_in_process(timeline, args, pacer) if args.in_process else replay_http(timeline, args, pacer))
+    elapsed = time.perf_counter() - start
+    print(f"Replayed in {elapsed:.2f}s ({duration_secs / max(elapsed, 1e-9):.1f}x), max lag {pacer.max_lag_ms:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Incrementally sync the device/ tree to one or more ESP32 boards.
+
+Strategy:
+1) Hash every local file under the source tree (sha256).
+2) Read the manifest of hashes left on the board by the previous sync
+   (`:.sync-manifest.json`).
+3) Copy only files whose hash changed, delete files that no longer exist locally,
+   then write the new manifest - all in a single mpremote session per board.
+4) With several ports (or --all-ports: every board tools/detect_port.py confirms
+   with esptool, cached), boards are synced in parallel.
+
+The manifest is written last, so an interrupted sync is simply redone next time.
+Files changed on the board behind the tool's back aren't noticed - use --full.
+
+Usage:
+  python tools/sync_device.py --port /dev/cu.SLAB_USBtoUART
+  python tools/sync_device.py --all-ports          # every detected ESP32 board
+  python tools/sync_device.py --port P --dry-run   # show what would change
+  python tools/sync_device.py --port P --full      # ignore the board's manifest
+"""
+import sys, os, json, time, hashlib, tempfile, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from detect_port import list_candidates, probe_all
+
+MANIFEST_PATH = ".sync-manifest.json"
+EXCLUDE_DIRS = {"__pycache__"}
+EXCLUDE_NAMES = {".gitkeep", ".DS_Store"}
+MPREMOTE = [sys.executable, "-m", "mpremote"]
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def local_manifest(src):
+    """{device path: sha256} for every file under src."""
+    manifest = {}
+    for root, dirs, files in os.walk(src):
+        dirs[:] = sorted(d for d in dirs if d not in EXCLUDE_DIRS)
+        for name in sorted(files):
+            if name in EXCLUDE_NAMES or name.endswith(".pyc"):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, src).replace(os.sep, "/")
+            manifest[rel] = file_hash(path)
+    return manifest
+
+
+def device_manifest(port):
+    """Manifest left by the previous sync, or {} if there's none (or it's unreadable)."""
+    cmd = MPREMOTE + ["connect", port, "sleep", "1", "fs", "cat", f":{MANIFEST_PATH}"]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False)
+    if proc.returncode != 0:
+        return {}
+    try:
+        return json.loads(proc.stdout)
+    except ValueError:
+        return {}
+
+
+def plan(local, remote):
+    changed = [path for path, digest in local.items() if remote.get(path) != digest]
+    removed = [path for path in remote if path not in local]
+    return changed, removed
+
+
+def _prepare_script(changed, removed):
+    """MicroPython snippet creating the parent dirs of changed files and deleting removed ones."""
+    dirs = sorted({os.path.dirname(path) for path in changed if os.path.dirname(path)})
+    return "\n".join([
+        "import os",
+        "def _mkdirs(p):",
+        "    cur = ''",
+        "    for part in p.split('/'):",
+        "        cur = part if not cur else cur + '/' + part",
+        "        try:",
+        "            os.mkdir(cur)",
+        "        except OSError:",
+        "            pass",
+        f"for d in {dirs!r}:",
+        "    _mkdirs(d)",
+        f"for f in {removed!r}:",
+        "    try:",
+        "        os.remove(f)",
+        "    except OSError:",
+        "        pass",
+    ])
+
+
+def sync_port(port, src, local, full=False, dry_run=False):
+    start = time.time()
+    remote = {} if full else device_manifest(port)
+    changed, removed = plan(local, remote)
+    if not changed and not removed:
+        return f"{port}: up to date"
+    if dry_run:
+        return f"{port}: would copy {changed}, delete {removed}"
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(local, f)
+        manifest_file = f.name
+    try:
+        cmd = MPREMOTE + ["connect", port, "exec", _prepare_script(changed, removed)]
+        for path in changed:
+            cmd += ["+", "fs", "cp", os.path.join(src, path), f":{path}"]
+        cmd += ["+", "fs", "cp", manifest_file, f":{MANIFEST_PATH}"]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=False)
+    finally:
+        os.unlink(manifest_file)
+
+    if proc.returncode != 0:
+        return f"{port}: FAILED\n{proc.stdout.strip()}"
+    return f"{port}: copied {len(changed)}, deleted {len(removed)} in {time.time() - start:.1f}s"
+
+
+def esp32_ports():
+    chips = probe_all(list_candidates())
+    return sorted(device for device, chip in chips.items() if chip)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", action="append", default=[], help="serial port to sync (repeatable)")
+    ap.add_argument("--all-ports", action="store_true", help="sync every detected ESP32 board")
+    ap.add_argument("--src", default="device", help="local tree to sync (default: device)")
+    ap.add_argument("--full", action="store_true", help="ignore the board's manifest and copy everything")
+    ap.add_argument("--dry-run", action="store_true", help="only print what would change")
+    args = ap.parse_args()
+
+    ports = list(args.port)
+    if args.all_ports:
+        ports += [p for p in esp32_ports() if p not in ports]
+    if not ports:
+        ap.error("no ports given (use --port or --all-ports)")
+
+    local = local_manifest(args.src)
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        results = list(pool.map(lambda port: sync_port(port, args.src, local, args.full, args.dry_run), ports))
+    for line in results:
+        print(line)
+    if any(": FAILED" in line for line in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()